@@ -1,5 +1,29 @@
-from flask import Flask, request, jsonify, make_response
-import requests, random, math
+from flask import Flask, Response, request, jsonify, g
+from flask.json.provider import DefaultJSONProvider
+from concurrent.futures import ThreadPoolExecutor, TimeoutError as FutureTimeout, as_completed, wait, FIRST_COMPLETED
+from collections import OrderedDict, deque
+from contextlib import contextmanager
+from bisect import bisect_left
+from functools import partial
+from itertools import count
+from urllib.parse import urlsplit
+from requests.adapters import HTTPAdapter
+import requests, random, math, os, time, threading, sqlite3, json, difflib, hashlib, gzip, contextvars, heapq, mmap, zlib, sys
+
+try:
+    import numpy as np
+except ImportError: # the local POI store falls back to per-row haversine_km
+    np = None
+
+try:
+    import brotli
+except ImportError: # the index page is then served gzip or uncompressed
+    brotli = None
+
+try:
+    import orjson
+except ImportError: # JSON is then encoded by the stdlib json module
+    orjson = None
 
 app = Flask(__name__)
 
@@ -7,6 +31,1492 @@ app = Flask(__name__)
 # NOTE: Replace with your actual Geoapify API key
 GEOAPIFY_KEY = "ecd717b7a44b4050b904f610ee762e8b"
 
+# Upstream base URLs (override to point at a local stub)
+GEOAPIFY_BASE_URL = os.environ.get("GEOAPIFY_BASE_URL", "https://api.geoapify.com")
+WIKIPEDIA_BASE_URL = os.environ.get("WIKIPEDIA_BASE_URL", "https://en.wikipedia.org")
+GEOCODE_URL = f"{GEOAPIFY_BASE_URL}/v1/geocode/search"
+PLACES_URL = f"{GEOAPIFY_BASE_URL}/v2/places"
+WIKIPEDIA_SEARCH_URL = f"{WIKIPEDIA_BASE_URL}/w/rest.php/v1/search/title"
+
+# Upstream lookups after geocoding (attractions, stays, restaurants) run on this pool.
+# Batch and prewarm plans use their own, so their lookups queued on the rate
+# limiter never hold the threads interactive requests need.
+UPSTREAM_WORKERS = int(os.environ.get("UPSTREAM_WORKERS", 16))
+upstream_pool = ThreadPoolExecutor(max_workers=UPSTREAM_WORKERS, thread_name_prefix="upstream")
+background_pool = ThreadPoolExecutor(max_workers=UPSTREAM_WORKERS, thread_name_prefix="background")
+
+# Who a request is for; lower values get rate-limited upstream quota first
+PRIORITIES = {"interactive": 0, "batch": 1, "prewarm": 2}
+request_priority = contextvars.ContextVar("request_priority", default="interactive")
+
+# Latency budget for one plan (seconds). Every upstream call's timeout is capped
+# by what is left of it; sections not done in time are reported as partial.
+PLAN_BUDGET = float(os.environ.get("PLAN_BUDGET", 8))
+request_deadline = contextvars.ContextVar("request_deadline", default=None) # time.monotonic() value
+
+# Batch planning (/plan_trips): items planned at once, and the largest batch accepted
+BATCH_WORKERS = int(os.environ.get("BATCH_WORKERS", 8))
+BATCH_MAX_ITEMS = int(os.environ.get("BATCH_MAX_ITEMS", 2000))
+
+# Geocode cache: in-process LRU in front of a SQLite file that survives restarts
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+GEOCODE_DB = os.environ.get("GEOCODE_DB", os.path.join(BASE_DIR, "geocode_cache.sqlite3"))
+GEOCODE_TTL = int(os.environ.get("GEOCODE_TTL", 30*24*3600)) # 30 days
+GEOCODE_LRU_SIZE = int(os.environ.get("GEOCODE_LRU_SIZE", 2048))
+GEOCODE_MAX_ROWS = int(os.environ.get("GEOCODE_MAX_ROWS", 100000)) # SQLite rows kept past expired ones
+GEOCODE_COUNTRY = os.environ.get("GEOCODE_COUNTRY", "India") # appended to network geocode queries
+
+# Host-wide cache shared by the worker processes of a prefork server: places
+# rows plus fetch claims, so each key is fetched upstream once per host
+SHARED_CACHE_DB = os.environ.get("SHARED_CACHE_DB", os.path.join(BASE_DIR, "shared_cache.sqlite3"))
+SHARED_CACHE_MAX_ROWS = int(os.environ.get("SHARED_CACHE_MAX_ROWS", 50000))
+SHARED_CLAIM_SECONDS = float(os.environ.get("SHARED_CLAIM_SECONDS", 15)) # longest another worker waits on a claimed fetch
+SHARED_POLL_SECONDS = 0.05
+
+# Offline gazetteer consulted before any cache or network geocode
+GAZETTEER_PATH = os.environ.get("GAZETTEER_PATH", os.path.join(BASE_DIR, "gazetteer_in.tsv"))
+GAZETTEER_FUZZY_CUTOFF = float(os.environ.get("GAZETTEER_FUZZY_CUTOFF", 0.88)) # difflib ratio, 1.0 disables
+
+# Negative caching: lookups that came back empty are not repeated upstream for a while
+NEGATIVE_TTL = int(os.environ.get("NEGATIVE_TTL", 900))
+NEGATIVE_ENTRIES = int(os.environ.get("NEGATIVE_ENTRIES", 10000))
+
+# Fallback chains (stays: primary -> broad -> default, attractions: places -> Wikipedia)
+# remember per places cell and mood which step last answered. A remembered step
+# is only used while every step it skips is still in the negative cache.
+FALLBACK_TTL = int(os.environ.get("FALLBACK_TTL", 6*3600))
+FALLBACK_ENTRIES = int(os.environ.get("FALLBACK_ENTRIES", 20000))
+
+# Region autocomplete (/suggest): gazetteer entries plus regions geocoded before.
+# Geoapify resolves nearly any text once ", India" is appended, so a geocoded
+# region is only suggested when its match was a confident, place-like result.
+SUGGEST_LIMIT = int(os.environ.get("SUGGEST_LIMIT", 8))
+SUGGEST_MAX_REGIONS = int(os.environ.get("SUGGEST_MAX_REGIONS", 20000)) # geocoded regions indexed, beyond the gazetteer
+SUGGEST_MIN_CONFIDENCE = float(os.environ.get("SUGGEST_MIN_CONFIDENCE", 0.9)) # Geoapify rank.confidence
+SUGGEST_RESULT_TYPES = set(os.environ.get("SUGGEST_RESULT_TYPES", "city,county,state,district,suburb").split(","))
+
+# Places cache: results are stored per grid cell, so nearby circles share one fetch
+PLACES_CELL_DEG = float(os.environ.get("PLACES_CELL_DEG", 0.02)) # ~2.2 km cells
+PLACES_CACHE_ENTRIES = int(os.environ.get("PLACES_CACHE_ENTRIES", 4096))
+PLACES_CACHE_MAX_POIS = int(os.environ.get("PLACES_CACHE_MAX_POIS", 200000))
+PLACES_FETCH_FACTOR = 2 # cell fetches cover a wider circle, so ask for more rows
+PLACES_TTL = { # seconds, by top-level Geoapify category
+    "catering": 24*3600,
+    "accommodation": 3*24*3600,
+    "tourism": 14*24*3600,
+    "religion": 30*24*3600,
+    "leisure": 14*24*3600,
+}
+PLACES_DEFAULT_TTL = 7*24*3600
+
+# Local POI store: every fetched place is kept in columnar arrays on a coarse grid
+POI_GRID_DEG = float(os.environ.get("POI_GRID_DEG", 0.1)) # ~11 km cells
+POI_STORE_MAX_POIS = int(os.environ.get("POI_STORE_MAX_POIS", 500000))
+
+# Prewarmed geocodes and places written by prewarm.py, mapped in at startup
+SNAPSHOT_PATH = os.environ.get("SNAPSHOT_PATH", os.path.join(BASE_DIR, "cache_snapshot.bin"))
+
+# Consolidated places (opt-in): one /v2/places query per plan for the union of its
+# attraction, stay and restaurant categories, which the sections then split locally.
+# The union shares one limit, so a dense category can crowd out a sparse one: the
+# sections are answered from the union's rows even when it came back full.
+PLACES_CONSOLIDATED = os.environ.get("PLACES_CONSOLIDATED", "0") == "1"
+PLACES_UNION_LIMIT = int(os.environ.get("PLACES_UNION_LIMIT", 150)) # x PLACES_FETCH_FACTOR per fetch
+RESTAURANT_CATEGORIES = ["catering.restaurant"]
+
+# Pricing: nightly stay range (INR) per mood. Prices are derived from a hash of
+# the place, so the same request always prices the same. PRICE_TABLE_FILE may
+# point at a JSON object of {"mood": [min, max]} overrides.
+PRICE_TABLE = {
+    "relaxed": (5000, 25000), # High-Value: ₹5,000 to ₹25,000
+    "cultural": (5000, 25000),
+    "adventurous": (800, 7000), # Low-Value: ₹800 to ₹7,000
+    "spiritual": (800, 7000),
+}
+DEFAULT_PRICE_RANGE = (800, 7000)
+TRAVEL_PRICE_RANGE = (500, 2000) # per day
+if os.environ.get("PRICE_TABLE_FILE"):
+    with open(os.environ["PRICE_TABLE_FILE"], encoding="utf-8") as f:
+        PRICE_TABLE.update({mood: tuple(r) for mood, r in json.load(f).items()})
+
+# Longest trip planned; days is also part of the plan cache key
+MAX_TRIP_DAYS = int(os.environ.get("MAX_TRIP_DAYS", 30))
+
+# Full /plan_trip response cache, keyed on normalized (region, days, mood)
+PLAN_CACHE_TTL = int(os.environ.get("PLAN_CACHE_TTL", 600))
+PLAN_CACHE_ENTRIES = int(os.environ.get("PLAN_CACHE_ENTRIES", 5000))
+
+# Section results (place lists) memoized per exact lookup, with their encoded JSON
+PLACE_LISTS_ENTRIES = int(os.environ.get("PLACE_LISTS_ENTRIES", 4096))
+PLACE_LISTS_TTL = int(os.environ.get("PLACE_LISTS_TTL", 3600))
+
+# The index page is compressed once at startup and revalidated by ETag
+INDEX_MAX_AGE = int(os.environ.get("INDEX_MAX_AGE", 86400))
+
+# Shared keep-alive HTTP client: connection pool size per upstream host, retry policy
+HTTP_POOL_SIZES = {
+    GEOAPIFY_BASE_URL: int(os.environ.get("GEOAPIFY_POOL_SIZE", 32)),
+    WIKIPEDIA_BASE_URL: int(os.environ.get("WIKIPEDIA_POOL_SIZE", 8)),
+}
+HTTP_RETRIES = int(os.environ.get("HTTP_RETRIES", 2))
+HTTP_BACKOFF = float(os.environ.get("HTTP_BACKOFF", 0.25)) # seconds, doubled per attempt
+HTTP_BACKOFF_MAX = float(os.environ.get("HTTP_BACKOFF_MAX", 4))
+HTTP_RETRY_STATUSES = {429, 500, 502, 503, 504}
+
+# Circuit breaker per upstream host: opens when more than BREAKER_FAILURE_RATIO of
+# the last BREAKER_WINDOW calls (at least BREAKER_MIN_CALLS) failed or took longer
+# than BREAKER_SLOW_CALL; after BREAKER_OPEN_SECONDS one probe call may close it.
+BREAKER_WINDOW = int(os.environ.get("BREAKER_WINDOW", 20))
+BREAKER_MIN_CALLS = int(os.environ.get("BREAKER_MIN_CALLS", 10))
+BREAKER_FAILURE_RATIO = float(os.environ.get("BREAKER_FAILURE_RATIO", 0.5))
+BREAKER_SLOW_CALL = float(os.environ.get("BREAKER_SLOW_CALL", 5))
+BREAKER_OPEN_SECONDS = float(os.environ.get("BREAKER_OPEN_SECONDS", 15))
+
+# Hedged requests (off by default): a GET still running after the host's recent
+# p95 latency is sent a second time and the first answer wins
+HTTP_HEDGE = os.environ.get("HTTP_HEDGE", "0") == "1"
+HTTP_HEDGE_QUANTILE = float(os.environ.get("HTTP_HEDGE_QUANTILE", 0.95))
+HTTP_HEDGE_MIN_DELAY = float(os.environ.get("HTTP_HEDGE_MIN_DELAY", 0.1))
+HTTP_HEDGE_MIN_SAMPLES = 20 # latencies needed before a host is hedged
+# every upstream_pool and background_pool thread may have a request and its hedge in flight
+HTTP_HEDGE_WORKERS = int(os.environ.get("HTTP_HEDGE_WORKERS", UPSTREAM_WORKERS * 2 * 2))
+
+# Upstream rate limits: requests/second per host (0 = unlimited), enforced
+# process-wide as token buckets. Set them just under the plan's quota (the Geoapify
+# free plan allows 5/s). At most RATE_LIMIT_QUEUE callers wait per host; the rest,
+# and any caller whose wait would outlast its budget, fail fast with RateLimited.
+RATE_LIMITS = {
+    urlsplit(GEOAPIFY_BASE_URL).netloc: float(os.environ.get("GEOAPIFY_RPS", 0)),
+    urlsplit(WIKIPEDIA_BASE_URL).netloc: float(os.environ.get("WIKIPEDIA_RPS", 0)),
+}
+RATE_LIMIT_BURST = float(os.environ.get("RATE_LIMIT_BURST", 1)) # seconds of quota an idle host may spend at once
+RATE_LIMIT_QUEUE = int(os.environ.get("RATE_LIMIT_QUEUE", 256))
+RATE_LIMIT_MAX_WAIT = float(os.environ.get("RATE_LIMIT_MAX_WAIT", 10)) # for calls without a request deadline
+
+# Latency histogram buckets (seconds) for /metrics
+METRICS_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+
+# ---------------- METRICS ----------------
+
+class Metrics:
+    # Minimal in-process Prometheus registry: counters, gauges and histograms
+    # keyed by (name, labels). render() writes the text exposition format.
+    def __init__(self, buckets):
+        self.buckets = buckets
+        self.lock = threading.Lock()
+        self.counters, self.gauges, self.histograms = {}, {}, {}
+
+    def inc(self, name, value=1, **labels):
+        key = (name, tuple(sorted(labels.items())))
+        with self.lock: self.counters[key] = self.counters.get(key, 0) + value
+
+    def gauge(self, name, delta, **labels):
+        key = (name, tuple(sorted(labels.items())))
+        with self.lock: self.gauges[key] = self.gauges.get(key, 0) + delta
+
+    def observe(self, name, value, **labels):
+        key = (name, tuple(sorted(labels.items())))
+        with self.lock:
+            h = self.histograms.get(key)
+            if h is None: h = self.histograms[key] = [[0] * (len(self.buckets) + 1), 0.0]
+            h[0][bisect_left(self.buckets, value)] += 1
+            h[1] += value
+
+    def render(self, extra=()):
+        # extra: (name, type, labels, value) series computed at scrape time
+        with self.lock:
+            counters, gauges = list(self.counters.items()), list(self.gauges.items())
+            histograms = [(key, list(counts), total) for key, (counts, total) in self.histograms.items()]
+        series = {}
+        def add(name, kind, line): series.setdefault(name, (kind, []))[1].append(line)
+        for (name, labels), value in counters: add(name, "counter", f"{name}{prom_labels(labels)} {value}")
+        for (name, labels), value in gauges: add(name, "gauge", f"{name}{prom_labels(labels)} {value}")
+        for (name, labels), counts, total in histograms:
+            running = 0
+            for bound, count in zip(self.buckets + ("+Inf",), counts):
+                running += count
+                add(name, "histogram", f"{name}_bucket{prom_labels(labels + (('le', bound),))} {running}")
+            add(name, "histogram", f"{name}_sum{prom_labels(labels)} {total:.6f}")
+            add(name, "histogram", f"{name}_count{prom_labels(labels)} {running}")
+        for name, kind, labels, value in extra:
+            add(name, kind, f"{name}{prom_labels(tuple(labels.items()))} {value}")
+        out = []
+        for name, (kind, lines) in sorted(series.items()):
+            out.append(f"# TYPE {name} {kind}")
+            out.extend(lines)
+        return "\n".join(out) + "\n"
+
+def prom_labels(labels):
+    if not labels: return ""
+    escaped = (str(v).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n") for _, v in labels)
+    return "{" + ",".join(f'{k}="{v}"' for (k, _), v in zip(labels, escaped)) + "}"
+
+metrics = Metrics(METRICS_BUCKETS)
+request_timings = contextvars.ContextVar("request_timings", default=None) # [(stage, seconds)] for Server-Timing
+
+@contextmanager
+def stage(name):
+    # Times one pipeline stage into the stage histogram and the current request's Server-Timing
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        elapsed = time.perf_counter() - started
+        metrics.observe("tripplanner_stage_seconds", elapsed, stage=name)
+        timings = request_timings.get()
+        if timings is not None: timings.append((name, elapsed))
+
+def timed(name, fn, *args):
+    with stage(name): return fn(*args)
+
+def server_timing(timings, total):
+    return ", ".join(f"{name};dur={seconds * 1000:.1f}" for name, seconds in list(timings or ()) + [("total", total)])
+
+# ---------------- CACHES ----------------
+
+class LRUCache:
+    # Thread-safe LRU with a per-entry expiry. Values are returned as stored.
+    # Optional max_weight bounds the summed weight of entries as well as their count.
+    def __init__(self, maxsize, ttl, max_weight=None):
+        self.maxsize, self.ttl, self.max_weight = maxsize, ttl, max_weight
+        self.data = OrderedDict()
+        self.weights = {}
+        self.weight = 0
+        self.lock = threading.Lock()
+        self.hits = self.misses = self.evictions = 0
+
+    def get(self, key, default=None):
+        with self.lock:
+            item = self.data.get(key)
+            if item is None or item[1] < time.time():
+                if item is not None: self._drop(key)
+                self.misses += 1
+                return default
+            self.data.move_to_end(key)
+            self.hits += 1
+            return item[0]
+
+    def put(self, key, value, ttl=None, weight=1):
+        with self.lock:
+            if key in self.data: self._drop(key)
+            self.data[key] = (value, time.time() + (self.ttl if ttl is None else ttl))
+            self.weights[key] = weight
+            self.weight += weight
+            while len(self.data) > self.maxsize or (self.max_weight and self.weight > self.max_weight and len(self.data) > 1):
+                self._drop(next(iter(self.data)))
+                self.evictions += 1
+
+    def _drop(self, key):
+        del self.data[key]
+        self.weight -= self.weights.pop(key)
+
+    def items(self):
+        # -> [(key, value, expires)] for live entries, least recently used first
+        now = time.time()
+        with self.lock:
+            return [(k, v, expires) for k, (v, expires) in self.data.items() if expires > now]
+
+    def stats(self):
+        return {"size": len(self.data), "weight": self.weight, "hits": self.hits,
+                "misses": self.misses, "evictions": self.evictions}
+
+def normalize_place(place):
+    # "  North GOA, " and "north goa" share one cache entry
+    return " ".join(str(place or "").lower().replace(",", " ").split())
+
+class GeocodeCache:
+    # Warm LRU over a SQLite table every worker on the host shares. Like
+    # SharedCache, every 256th write purges expired rows, then the oldest past max_rows.
+    def __init__(self, path, ttl, lru_size, max_rows):
+        self.ttl, self.max_rows = ttl, max_rows
+        self.lru = LRUCache(lru_size, ttl)
+        self.lock = threading.Lock()
+        self.hits = self.misses = self.writes = self.evictions = 0
+        self.path, self.pid, self.db = path, None, None
+        with self.lock:
+            db = self.conn()
+            db.execute("CREATE TABLE IF NOT EXISTS geocode (key TEXT PRIMARY KEY, lat REAL, lon REAL, fetched_at REAL, "
+                       "suggest INTEGER NOT NULL DEFAULT 0)")
+            if "suggest" not in [c[1] for c in db.execute("PRAGMA table_info(geocode)")]:
+                # a cache from before suggestions were gated: its rows were never checked
+                try:
+                    db.execute("ALTER TABLE geocode ADD COLUMN suggest INTEGER NOT NULL DEFAULT 0")
+                except sqlite3.OperationalError:
+                    pass # another worker added it first
+            db.execute("CREATE INDEX IF NOT EXISTS geocode_fetched_at ON geocode (fetched_at)")
+            db.commit()
+            self.evict()
+
+    def conn(self):
+        # Every worker on the host opens the same file; WAL lets them read while
+        # one writes. As in SharedCache, a connection inherited across a fork is reopened.
+        if self.pid != os.getpid():
+            self.pid = os.getpid()
+            self.db = sqlite3.connect(self.path, timeout=5, check_same_thread=False)
+            self.db.execute("PRAGMA journal_mode=WAL")
+        return self.db
+
+    def get(self, key):
+        return self.warm(key) or self.cold(key)
+
+    def warm(self, key):
+        # the in-process tier alone; None means ask cold(), which may read SQLite
+        coords = self.lru.get(key)
+        if coords: self.hits += 1
+        return coords
+
+    def cold(self, key):
+        # the SQLite tier, after warm() missed; the async app runs it in a thread
+        coords = self.stored(key)
+        if coords: self.hits += 1
+        else: self.misses += 1
+        return coords
+
+    def suggestable(self, limit):
+        # live keys whose geocode passed the suggestion check, most recent first
+        with self.lock:
+            return [k for (k,) in self.conn().execute("SELECT key FROM geocode WHERE suggest = 1 AND fetched_at > ? "
+                                                      "ORDER BY fetched_at DESC LIMIT ?", (time.time() - self.ttl, limit))]
+
+    def stored(self, key):
+        # the SQLite row, which another worker may have written
+        with self.lock:
+            row = self.conn().execute("SELECT lat, lon, fetched_at FROM geocode WHERE key = ?", (key,)).fetchone()
+        if row and row[2] + self.ttl > time.time():
+            # keep the warm tier's expiry in line with the row's remaining lifetime
+            self.lru.put(key, (row[0], row[1]), ttl=row[2] + self.ttl - time.time())
+            return row[0], row[1]
+        return None
+
+    def put(self, key, lat, lon, suggest=False):
+        self.lru.put(key, (lat, lon))
+        try:
+            with self.lock:
+                db = self.conn()
+                db.execute("INSERT OR REPLACE INTO geocode (key, lat, lon, fetched_at, suggest) VALUES (?, ?, ?, ?, ?)",
+                           (key, lat, lon, time.time(), int(suggest)))
+                db.commit()
+                self.writes += 1
+                if self.writes % 256 == 0: self.evict()
+        except sqlite3.Error as e:
+            print("⚠️ Geocode cache write failed:", e)
+
+    def evict(self):
+        # callers hold self.lock
+        with self.db:
+            gone = self.db.execute("DELETE FROM geocode WHERE fetched_at <= ?", (time.time() - self.ttl,)).rowcount
+            over = self.db.execute("SELECT COUNT(*) FROM geocode").fetchone()[0] - self.max_rows
+            if over > 0:
+                gone += self.db.execute("DELETE FROM geocode WHERE key IN (SELECT key FROM geocode ORDER BY fetched_at LIMIT ?)", (over,)).rowcount
+        self.evictions += gone
+
+    def stats(self):
+        total = self.hits + self.misses
+        with self.lock:
+            rows = self.conn().execute("SELECT COUNT(*) FROM geocode").fetchone()[0]
+        return {"hits": self.hits, "misses": self.misses,
+                "hit_ratio": round(self.hits / total, 3) if total else 0.0,
+                "rows": rows, "evictions": self.evictions, "lru": self.lru.stats()}
+
+geocode_cache = GeocodeCache(GEOCODE_DB, GEOCODE_TTL, GEOCODE_LRU_SIZE, GEOCODE_MAX_ROWS)
+
+class SharedCache:
+    # Places rows and fetch claims in one SQLite file that every worker on the
+    # host opens. WAL mode keeps readers off the writer's lock; each write is
+    # one transaction, so readers see a whole entry or none. Expired rows, then
+    # those closest to expiry, are evicted past max_rows.
+    def __init__(self, path, max_rows):
+        self.path, self.max_rows = path, max_rows
+        self.lock = threading.Lock()
+        self.hits = self.misses = self.writes = self.evictions = self.claims = self.waits = 0
+        self.pid, self.db = None, None
+        with self.lock:
+            db = self.conn()
+            db.execute("CREATE TABLE IF NOT EXISTS entries (key TEXT PRIMARY KEY, value BLOB, expires REAL)")
+            db.execute("CREATE INDEX IF NOT EXISTS entries_expires ON entries (expires)")
+            db.execute("CREATE TABLE IF NOT EXISTS claims (key TEXT PRIMARY KEY, owner INTEGER, expires REAL)")
+
+    def conn(self):
+        # one connection per process: one inherited across a fork (preloaded app) is reopened
+        if self.pid != os.getpid():
+            self.pid = os.getpid()
+            self.db = sqlite3.connect(self.path, timeout=5, check_same_thread=False, isolation_level=None)
+            self.db.execute("PRAGMA journal_mode=WAL")
+            self.db.execute("PRAGMA synchronous=NORMAL")
+        return self.db
+
+    def get(self, key, count=True):
+        # -> (value, expires) or None; polls for another worker's fetch pass count=False
+        with self.lock:
+            row = self.conn().execute("SELECT value, expires FROM entries WHERE key = ? AND expires > ?", (key, time.time())).fetchone()
+        if count:
+            if row is None: self.misses += 1
+            else: self.hits += 1
+        return row
+
+    def put(self, key, value, ttl):
+        try:
+            with self.lock:
+                self.conn().execute("INSERT OR REPLACE INTO entries VALUES (?, ?, ?)", (key, value, time.time() + ttl))
+                self.writes += 1
+                if self.writes % 256 == 0: self.evict()
+        except sqlite3.Error as e:
+            print("⚠️ Shared cache write failed:", e)
+
+    def evict(self):
+        now = time.time()
+        with self.db:
+            gone = self.db.execute("DELETE FROM entries WHERE expires <= ?", (now,)).rowcount
+            over = self.db.execute("SELECT COUNT(*) FROM entries").fetchone()[0] - self.max_rows
+            if over > 0:
+                gone += self.db.execute("DELETE FROM entries WHERE key IN (SELECT key FROM entries ORDER BY expires LIMIT ?)", (over,)).rowcount
+            self.db.execute("DELETE FROM claims WHERE expires <= ?", (now,))
+        self.evictions += gone
+
+    def claim(self, key, seconds):
+        # True if this process now owns the fetch for key; a lapsed claim is taken
+        # over. One write transaction, so two workers cannot both take it over.
+        now = time.time()
+        try:
+            with self.lock:
+                with self.conn():
+                    self.db.execute("BEGIN IMMEDIATE")
+                    self.db.execute("DELETE FROM claims WHERE key = ? AND expires <= ?", (key, now))
+                    won = self.db.execute("INSERT OR IGNORE INTO claims VALUES (?, ?, ?)", (key, self.pid, now + seconds)).rowcount == 1
+        except sqlite3.Error as e:
+            print("⚠️ Shared cache claim failed:", e)
+            return True # fetch without coordination rather than not at all
+        self.claims += won
+        return won
+
+    def claimed(self, key):
+        with self.lock:
+            return self.conn().execute("SELECT 1 FROM claims WHERE key = ? AND expires > ?", (key, time.time())).fetchone() is not None
+
+    def release(self, key):
+        try:
+            with self.lock:
+                self.conn().execute("DELETE FROM claims WHERE key = ? AND owner = ?", (key, self.pid))
+        except sqlite3.Error as e:
+            print("⚠️ Shared cache release failed:", e)
+
+    def stats(self):
+        with self.lock:
+            rows = self.conn().execute("SELECT COUNT(*) FROM entries").fetchone()[0]
+        return {"rows": rows, "hits": self.hits, "misses": self.misses, "writes": self.writes,
+                "evictions": self.evictions, "claims": self.claims, "waits": self.waits}
+
+shared_cache = SharedCache(SHARED_CACHE_DB, SHARED_CACHE_MAX_ROWS)
+
+def wait_deadline():
+    # how long to wait on another worker's fetch: the claim window, capped by the request budget
+    until = time.monotonic() + SHARED_CLAIM_SECONDS
+    deadline = request_deadline.get()
+    return until if deadline is None else min(until, deadline)
+
+def host_once(name, lookup, fetch):
+    # One upstream fetch per host for `name`: the worker that claims it runs
+    # fetch() (which publishes the result); the others poll lookup() until the
+    # result lands, the claim is released or lapses, or the budget runs out,
+    # and only then fetch for themselves.
+    if not shared_cache.claim(name, SHARED_CLAIM_SECONDS):
+        shared_cache.waits += 1
+        until = wait_deadline()
+        while time.monotonic() < until:
+            found = lookup()
+            if found is not None: return found
+            if not shared_cache.claimed(name): break
+            time.sleep(SHARED_POLL_SECONDS)
+        found = lookup()
+        return found if found is not None else fetch()
+    try:
+        return fetch()
+    finally:
+        shared_cache.release(name)
+
+negatives = LRUCache(NEGATIVE_ENTRIES, NEGATIVE_TTL)
+
+def known_missing(name):
+    # True while a recent lookup of name came back empty, in any worker on the host
+    if negatives.get(name): return True
+    found = shared_cache.get("missing:" + name, False)
+    if found is None: return False
+    negatives.put(name, True, ttl=found[1] - time.time())
+    return True
+
+def remember_missing(name):
+    # only for answers that really were empty, never for failed lookups
+    negatives.put(name, True)
+    shared_cache.put("missing:" + name, b"", NEGATIVE_TTL)
+
+# ---------------- GAZETTEER ----------------
+
+class Gazetteer:
+    # Bundled Indian cities, towns and regions: an exact dict over normalized
+    # names and aliases, plus a difflib fuzzy match for typos ("rishikesh" vs "rishikes").
+    def __init__(self, path, fuzzy_cutoff):
+        self.fuzzy_cutoff = fuzzy_cutoff
+        self.places = [] # {"name", "lat", "lon", "kind", "popularity"}
+        self.index = {} # normalized name or alias -> place
+        self.by_initial = {} # first letter -> index keys, narrows the fuzzy scan
+        self.hits = self.fuzzy_hits = self.misses = 0
+        try:
+            with open(path, encoding="utf-8") as f:
+                for n, line in enumerate(f, 1):
+                    if not line.strip() or line.startswith("#"): continue
+                    try:
+                        self.add(*line.rstrip("\n").split("\t"))
+                    except (TypeError, ValueError) as e: # wrong column count, non-numeric field
+                        print(f"⚠️ Gazetteer line {n} skipped:", e)
+        except OSError as e:
+            print("⚠️ Gazetteer not loaded:", e)
+
+    def add(self, name, lat, lon, kind, popularity, aliases=""):
+        place = {"name": name, "lat": float(lat), "lon": float(lon), "kind": kind, "popularity": int(popularity)}
+        self.places.append(place)
+        for alias in [name] + [a for a in aliases.split("|") if a]:
+            key = gazetteer_key(alias)
+            if key in self.index: continue
+            self.index[key] = place
+            self.by_initial.setdefault(key[:1], []).append(key)
+
+    def lookup(self, text):
+        key = gazetteer_key(text)
+        place = self.index.get(key)
+        if place is None and self.fuzzy_cutoff < 1 and key:
+            close = difflib.get_close_matches(key, self.by_initial.get(key[:1], ()), n=1, cutoff=self.fuzzy_cutoff)
+            if close:
+                place = self.index[close[0]]
+                self.fuzzy_hits += 1
+        if place is None:
+            self.misses += 1
+            return None
+        self.hits += 1
+        return place["lat"], place["lon"]
+
+    def stats(self):
+        return {"places": len(self.places), "names": len(self.index), "hits": self.hits,
+                "fuzzy_hits": self.fuzzy_hits, "misses": self.misses}
+
+def gazetteer_key(text):
+    words = normalize_place(text).split()
+    if words and words[-1] == "india": words.pop()
+    return " ".join(words)
+
+gazetteer = Gazetteer(GAZETTEER_PATH, GAZETTEER_FUZZY_CUTOFF)
+
+class Suggester:
+    # Prefix index for region autocomplete: one sorted array of normalized
+    # names and aliases, plus each later word of them so "goa" also finds
+    # "North Goa". A prefix is one bisect; matches starting at the first word
+    # rank above inner-word ones, then by popularity. Geocoded regions rank by
+    # how often they are planned. Nothing here touches the network.
+    def __init__(self, places, index, regions, max_regions):
+        # places: gazetteer place dicts; index: the gazetteer's name -> place;
+        # regions: keys of previously geocoded places that passed the suggestion check
+        self.index, self.max_regions = index, max_regions
+        self.lock = threading.Lock()
+        self.regions = {} # geocoded key -> place
+        self.queries = 0
+        aliases = {}
+        for key, place in index.items(): aliases.setdefault(id(place), []).append(key)
+        rows = [row for place in places for row in self.rows(place, aliases.get(id(place), [place["name"]]))]
+        for key in regions:
+            place = self.region(key)
+            if place is not None: rows += self.rows(place, [key])
+        rows.sort(key=lambda r: r[0])
+        self.terms = [term for term, _, _ in rows] # sorted search strings
+        self.entries = [(inner, place) for _, inner, place in rows] # parallel (inner word?, place)
+
+    def rows(self, place, aliases):
+        # (term, inner word?, place) for every name and every later word of it
+        for alias in aliases:
+            words = gazetteer_key(alias).split()
+            for i in range(len(words)):
+                yield " ".join(words[i:]), i > 0, place
+
+    def region(self, key):
+        # a new place for a geocoded region, or None when already indexed or over the cap
+        if key in self.regions or len(self.regions) >= self.max_regions or gazetteer_key(key) in self.index: return None
+        place = self.regions[key] = {"name": key.title(), "kind": "geocoded", "popularity": 0}
+        return place
+
+    def add_region(self, key):
+        # a region just geocoded upstream, with a match that passed geocode_suggestable
+        with self.lock:
+            place = self.region(key)
+            if place is None: return
+            for term, inner, _ in self.rows(place, [key]):
+                at = bisect_left(self.terms, term)
+                self.terms.insert(at, term)
+                self.entries.insert(at, (inner, place))
+
+    def planned(self, key):
+        with self.lock:
+            place = self.regions.get(key)
+            if place is not None: place["popularity"] += 1
+
+    def suggest(self, text, limit):
+        prefix = gazetteer_key(text)
+        if not prefix: return []
+        self.queries += 1
+        with self.lock:
+            lo = bisect_left(self.terms, prefix)
+            hi = bisect_left(self.terms, prefix + "\uffff", lo)
+            matches = self.entries[lo:hi]
+        best = {} # one suggestion per place, at its best rank
+        for inner, place in matches:
+            rank = (not inner, place["popularity"])
+            if id(place) not in best or rank > best[id(place)][0]: best[id(place)] = (rank, place)
+        top = heapq.nlargest(limit, best.values(), key=lambda b: b[0])
+        return [{"name": place["name"], "kind": place["kind"]} for _, place in top]
+
+    def stats(self):
+        return {"terms": len(self.terms), "geocoded_regions": len(self.regions), "queries": self.queries}
+
+suggester = Suggester(gazetteer.places, gazetteer.index, geocode_cache.suggestable(SUGGEST_MAX_REGIONS), SUGGEST_MAX_REGIONS)
+
+# ---------------- POI ----------------
+
+class POI:
+    # One place as the caches hold it: slotted, with interned name and address
+    # strings and a shared category tuple. Treated as immutable, so cached POIs
+    # are handed out without copying. The JSON shape, map_url included, is only
+    # built by to_dict when a response is serialized.
+    __slots__ = ("name", "address", "lat", "lon", "categories", "url")
+
+    def __init__(self, name, address, lat=None, lon=None, categories=(), url=None):
+        self.name, self.address = sys.intern(name), sys.intern(address)
+        self.lat, self.lon = lat, lon
+        self.categories = CATEGORY_TUPLES.setdefault(categories, categories)
+        self.url = url # an explicit link (Wikipedia); otherwise a map link from lat/lon
+
+    def key(self):
+        # value identity, for memo keys: the same place from two fetches shares entries
+        return self.name, self.address, self.lat, self.lon, self.url
+
+    @property
+    def map_url(self):
+        if self.url is not None: return self.url
+        return f"https://www.google.com/maps/search/?api=1&query={self.lat},{self.lon}"
+
+    def to_dict(self):
+        d = {"name": self.name, "address": self.address, "map_url": self.map_url}
+        if self.lat is not None: d["lat"], d["lon"] = self.lat, self.lon
+        return d
+
+class Stay(POI):
+    # A POI priced for one mood
+    __slots__ = ("price_inr", "tier")
+
+    def __init__(self, poi, price_inr, tier):
+        super().__init__(poi.name, poi.address, poi.lat, poi.lon, poi.categories, poi.url)
+        self.price_inr, self.tier = price_inr, tier
+
+    def to_dict(self):
+        return dict(super().to_dict(), price_inr=self.price_inr, tier=self.tier)
+
+CATEGORY_TUPLES = {} # one shared tuple per distinct category list
+
+class PlaceList(list):
+    # A section's places as cached and served. Its JSON is encoded once, on
+    # first use, and spliced into every response carrying this list, so it
+    # must not be mutated once handed out.
+    __slots__ = ("_encoded",)
+
+    def encoded(self):
+        try:
+            return self._encoded
+        except AttributeError:
+            self._encoded = json_encode(list(self))
+            return self._encoded
+
+place_lists = LRUCache(PLACE_LISTS_ENTRIES, PLACE_LISTS_TTL)
+
+# ---------------- JSON ----------------
+
+def pack_rows(rows):
+    # POIs -> compact bytes for the snapshot and the shared cache
+    rows = [[p.lat, p.lon, p.name, p.address, p.categories] for p in rows]
+    return zlib.compress(json.dumps(rows, separators=(",", ":")).encode(), 9)
+
+def unpack_rows(blob):
+    return [POI(name, address, lat, lon, tuple(cats)) for lat, lon, name, address, cats in json.loads(zlib.decompress(blob))]
+
+def json_default(obj):
+    # encoder hook: POIs are rendered to their JSON shape at serialization time
+    if isinstance(obj, POI): return obj.to_dict()
+    raise TypeError(f"{type(obj).__name__} is not JSON serializable")
+
+if orjson is not None:
+    def json_encode(obj):
+        return orjson.dumps(obj, default=json_default)
+    json_loads = orjson.loads
+else:
+    def json_encode(obj):
+        return json.dumps(obj, default=json_default, separators=(",", ":"), ensure_ascii=False).encode()
+    json_loads = json.loads
+
+def json_bytes(obj):
+    # -> compact UTF-8 JSON for every response body. PlaceLists, at the top or
+    # anywhere down a chain of dicts, are spliced in from their cached encoding.
+    if isinstance(obj, PlaceList): return obj.encoded()
+    if isinstance(obj, dict) and has_place_lists(obj):
+        return b"{" + b",".join(json_encode(k) + b":" + json_bytes(v) for k, v in obj.items()) + b"}"
+    return json_encode(obj)
+
+def has_place_lists(d):
+    return any(isinstance(v, PlaceList) or (isinstance(v, dict) and has_place_lists(v)) for v in d.values())
+
+def json_dumps(obj):
+    return json_bytes(obj).decode()
+
+class FastJSONProvider(DefaultJSONProvider):
+    # jsonify() and request.get_json() through the same encoder as plan bodies
+    def dumps(self, obj, **kw):
+        return json_dumps(obj)
+
+    def loads(self, s, **kw):
+        return json_loads(s)
+
+    def response(self, *args, **kw):
+        return self._app.response_class(json_bytes(self._prepare_response_obj(args, kw)), mimetype=self.mimetype)
+
+app.json = FastJSONProvider(app)
+
+def places_cell(lat, lon, categories, radius, limit):
+    # Snap the centre to its grid cell and widen the radius by the cell's half
+    # diagonal: the fetched circle then contains the circle of any request
+    # centred in that cell, and results are trimmed back locally.
+    i, j = math.floor(lat / PLACES_CELL_DEG), math.floor(lon / PLACES_CELL_DEG)
+    key = (i, j, tuple(sorted(set(categories))), int(radius), int(limit))
+    return (key,) + cell_circle(i, j, radius)
+
+def cell_circle(i, j, radius):
+    # -> (centre, fetch radius) of grid cell (i, j) for a request radius
+    clat, clon = (i + 0.5) * PLACES_CELL_DEG, (j + 0.5) * PLACES_CELL_DEG
+    pad_m = haversine_km(clat, clon, i * PLACES_CELL_DEG, j * PLACES_CELL_DEG) * 1000
+    return (round(clat, 6), round(clon, 6)), int(radius + math.ceil(pad_m))
+
+def places_ttl(categories):
+    return min(PLACES_TTL.get(c.split(".")[0], PLACES_DEFAULT_TTL) for c in categories)
+
+def nearest_places(rows, lat, lon, radius, limit):
+    # rows are POIs, nearest first within radius
+    near = []
+    for poi in rows:
+        d = haversine_km(lat, lon, poi.lat, poi.lon)
+        if d * 1000 <= radius: near.append((d, poi))
+    near.sort(key=lambda x: x[0])
+    return PlaceList(poi for _, poi in near[:limit])
+
+places_cache = LRUCache(PLACES_CACHE_ENTRIES, PLACES_DEFAULT_TTL, max_weight=PLACES_CACHE_MAX_POIS)
+
+# ---------------- LOCAL POI STORE ----------------
+
+class POIStore:
+    # Places from every fetch (or an import), deduplicated and kept as columns:
+    # lat/lon arrays plus parallel lists of POIs and category sets.
+    # A grid over POI_GRID_DEG cells picks the candidate rows for a radius query.
+    # Each complete fetch (fewer rows than it asked for) also records the circle
+    # and categories it covered, so later requests inside a covered circle are
+    # answered without the network.
+    def __init__(self, grid_deg, max_pois):
+        self.grid_deg, self.max_pois = grid_deg, max_pois
+        self.lock = threading.Lock()
+        self.queries = self.resets = 0
+        self.reset()
+
+    def reset(self):
+        self.lats, self.lons, self.places, self.categories = [], [], [], []
+        self.ids = {} # (name, lat, lon) -> row
+        self.grid = {} # cell -> [rows]
+        self.coverage = {} # cell of the centre -> [(lat, lon, radius_m, categories, expires)]
+        self.max_cover_m = 0
+        # NumPy copies of lats/lons, appended to on ingest; capacity doubles as they fill
+        self.arrays = (np.empty(1024), np.empty(1024)) if np is not None else None
+
+    def cell(self, lat, lon):
+        return math.floor(lat / self.grid_deg), math.floor(lon / self.grid_deg)
+
+    def cells_around(self, lat, lon, radius_m):
+        ci, cj = self.cell(lat, lon)
+        di = math.ceil(radius_m / 111000 / self.grid_deg)
+        dj = math.ceil(radius_m / (111000 * max(0.1, math.cos(math.radians(lat)))) / self.grid_deg)
+        return [(i, j) for i in range(ci - di, ci + di + 1) for j in range(cj - dj, cj + dj + 1)]
+
+    def ingest(self, rows, center=None, radius=None, categories=None, ttl=PLACES_DEFAULT_TTL):
+        with self.lock:
+            if len(self.places) + len(rows) > self.max_pois:
+                print(f"⚠️ POI store over {self.max_pois} places, clearing it")
+                self.resets += 1
+                self.reset()
+            start = len(self.places)
+            for poi in rows:
+                key = (poi.name, round(poi.lat, 5), round(poi.lon, 5))
+                i = self.ids.get(key)
+                if i is None:
+                    i = self.ids[key] = len(self.places)
+                    self.lats.append(poi.lat); self.lons.append(poi.lon)
+                    self.places.append(poi); self.categories.append(set(poi.categories))
+                    self.grid.setdefault(self.cell(poi.lat, poi.lon), []).append(i)
+                else:
+                    self.places[i] = poi
+                    self.categories[i].update(poi.categories)
+            self.extend_arrays(start)
+            if center is not None:
+                now = time.time()
+                covered = [c for c in self.coverage.get(self.cell(*center), []) if c[4] > now]
+                covered.append((center[0], center[1], radius, frozenset(categories), now + ttl))
+                self.coverage[self.cell(*center)] = covered
+                self.max_cover_m = max(self.max_cover_m, radius)
+
+    def extend_arrays(self, start):
+        # copy rows added since `start` into the NumPy columns (caller holds the lock)
+        n = len(self.lats)
+        if np is None or n == start: return
+        lats, lons = self.arrays
+        if n > len(lats):
+            cap = max(n, 2 * len(lats))
+            grown = np.empty(cap), np.empty(cap)
+            grown[0][:start], grown[1][:start] = lats[:start], lons[:start]
+            lats, lons = self.arrays = grown
+        lats[start:n], lons[start:n] = self.lats[start:n], self.lons[start:n]
+
+    def covers(self, lat, lon, radius, categories):
+        now = time.time()
+        with self.lock:
+            for c in self.cells_around(lat, lon, self.max_cover_m):
+                for clat, clon, cradius, ccats, expires in self.coverage.get(c, ()):
+                    if expires > now and all(category_within(w, ccats) for w in categories) \
+                            and haversine_km(lat, lon, clat, clon) * 1000 + radius <= cradius:
+                        return True
+        return False
+
+    def query(self, lat, lon, categories, radius=15000, limit=30):
+        # -> geoapify_places-shaped results, nearest first
+        with self.lock:
+            self.queries += 1
+            rows = [i for c in self.cells_around(lat, lon, radius) for i in self.grid.get(c, ())]
+            if not rows: return []
+            if np is not None:
+                idx = np.array(rows)
+                d = haversine_km_many(lat, lon, self.arrays[0][idx], self.arrays[1][idx])
+                near = [(d[k], rows[k]) for k in np.flatnonzero(d * 1000 <= radius)]
+            else:
+                near = [(d, i) for i in rows for d in [haversine_km(lat, lon, self.lats[i], self.lons[i])] if d * 1000 <= radius]
+            near = [(d, i) for d, i in near if any(category_within(c, categories) for c in self.categories[i])]
+            near.sort(key=lambda x: x[0])
+            return PlaceList(self.places[i] for _, i in near[:limit])
+
+    def stats(self):
+        with self.lock:
+            return {"pois": len(self.places), "covered_circles": sum(len(v) for v in self.coverage.values()),
+                    "queries": self.queries, "resets": self.resets, "numpy": np is not None}
+
+def category_within(category, parents):
+    # "accommodation.hotel" is within ["accommodation"]; Geoapify categories are dotted paths
+    return any(category == p or category.startswith(p + ".") for p in parents)
+
+def haversine_km_many(lat, lon, lats, lons):
+    # haversine_km from one point to arrays of points
+    phi1, phi2 = math.radians(lat), np.radians(lats)
+    dphi = phi2 - phi1
+    dlambda = np.radians(lons) - math.radians(lon)
+    a = np.sin(dphi/2)**2 + math.cos(phi1)*np.cos(phi2)*np.sin(dlambda/2)**2
+    return 6371.0 * 2 * np.arctan2(np.sqrt(a), np.sqrt(1 - a))
+
+poi_store = POIStore(POI_GRID_DEG, POI_STORE_MAX_POIS)
+
+def local_places(key, lat, lon, categories, radius, limit):
+    # The memoized answer, else the local tiers; None means fetch
+    found = memoized_places(key, lat, lon)
+    return found if found is not None else stored_places(key, lat, lon, categories, radius, limit)
+
+def memoized_places(key, lat, lon):
+    # answers are memoized per exact lookup, so repeats share one PlaceList and its JSON
+    return place_lists.get(("places", key, lat, lon))
+
+def stored_places(key, lat, lon, categories, radius, limit):
+    # Cell cache, the shared SQLite cache, then any covering circle in the POI
+    # store. It may read SQLite, so the async app runs it in a thread.
+    rows = places_cache.get(key)
+    if rows is None: rows = shared_rows(key)
+    covered = rows is None and poi_store.covers(lat, lon, radius, categories)
+    if rows is None and not covered and snapshot.promote(lat, lon, radius, categories):
+        # the snapshot may hold this very fetch, or a complete one around it
+        rows = places_cache.get(key)
+        covered = rows is None and poi_store.covers(lat, lon, radius, categories)
+    if rows is not None:
+        found = nearest_places(rows, lat, lon, radius, limit)
+    elif covered:
+        found = poi_store.query(lat, lon, categories, radius, limit)
+    elif known_missing(shared_name(key)):
+        return PlaceList()
+    else:
+        return None
+    place_lists.put(("places", key, lat, lon), found)
+    return found
+
+def places_missing(lat, lon, categories, radius=15000, limit=30):
+    # True while this lookup is remembered as having no places (never after a failed fetch)
+    return known_missing(shared_name(places_cell(lat, lon, categories, radius, limit)[0]))
+
+def shared_name(key):
+    return "places:" + json.dumps(key, separators=(",", ":"))
+
+def shared_rows(key, count=True):
+    # rows another worker fetched for this cell, kept in this process's tiers too
+    found = shared_cache.get(shared_name(key), count)
+    if found is None: return None
+    rows = unpack_rows(found[0])
+    (lat, lon), radius = cell_circle(key[0], key[1], key[3])
+    store_places(key, rows, lat, lon, key[2], radius, ttl=found[1] - time.time())
+    return rows
+
+def settled_rows(key):
+    # another worker's answer for this cell: its rows, or [] if it found none
+    rows = shared_rows(key, False)
+    if rows is None and known_missing(shared_name(key)): return []
+    return rows
+
+def publish_rows(key, rows, categories):
+    # a fresh upstream fetch, for the other workers on this host
+    if rows: shared_cache.put(shared_name(key), pack_rows(rows), places_ttl(categories))
+
+def store_places(key, rows, lat, lon, categories, radius, ttl=None):
+    # Keep a cell fetch in both local tiers; empty results are not cached.
+    if not rows: return
+    ttl = places_ttl(categories) if ttl is None else ttl
+    places_cache.put(key, rows, ttl=ttl, weight=len(rows))
+    poi_store.ingest(rows, (lat, lon) if fetch_covers(key, rows) else None, radius, categories, ttl)
+
+def fetch_covers(key, rows):
+    # A fetch that came back full may have been cut off, so its circle is not
+    # recorded as covered: another limit or subcategory there still goes upstream.
+    # The consolidated union is the exception: its sections are answered from
+    # its rows by design (see PLACES_UNION_LIMIT), so it always covers.
+    return len(rows) < key[4] * PLACES_FETCH_FACTOR or (PLACES_CONSOLIDATED and key[4] == PLACES_UNION_LIMIT)
+
+# ---------------- SNAPSHOT ----------------
+
+SNAPSHOT_MAGIC = b"TPSNAP2\n"
+
+class Snapshot:
+    # Geocodes and cell fetches saved by prewarm.py. Layout: magic, 8-byte index
+    # length, a JSON index, then one zlib-compressed JSON blob of rows per fetch.
+    # Startup maps the file and parses only the index; a fetch's rows are decoded
+    # the first time a request falls inside its circle, then move to the
+    # places cache and POI store, so a cold process answers prewarmed
+    # destinations locally without paying to load the whole file.
+    def __init__(self, path):
+        self.path = path
+        self.lock = threading.Lock()
+        self.mm, self.created = None, None
+        self.geocodes = {} # normalized place -> (lat, lon, expires)
+        self.pending = {} # POI store cell of the centre -> [(key, lat, lon, radius, categories, expires, offset, length)]
+        self.max_radius = 0
+        self.geocode_hits = self.promoted = 0
+        try:
+            self.open(path)
+        except FileNotFoundError:
+            pass
+        except (OSError, ValueError, KeyError) as e:
+            print("⚠️ Snapshot not loaded:", e)
+
+    def open(self, path):
+        with open(path, "rb") as f:
+            mm = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        start = len(SNAPSHOT_MAGIC) + 8
+        if mm[:len(SNAPSHOT_MAGIC)] != SNAPSHOT_MAGIC: raise ValueError(f"{path} is not a snapshot")
+        end = start + int.from_bytes(mm[len(SNAPSHOT_MAGIC):start], "little")
+        index = json.loads(mm[start:end])
+        now = time.time()
+        self.geocodes = {key: (lat, lon, expires) for key, lat, lon, expires in index["geocodes"] if expires > now}
+        for key, lat, lon, radius, categories, expires, offset, length in index["places"]:
+            if expires <= now: continue
+            key = (key[0], key[1], tuple(key[2]), key[3], key[4])
+            entry = (key, lat, lon, radius, frozenset(categories), expires, end + offset, length)
+            self.pending.setdefault(poi_store.cell(lat, lon), []).append(entry)
+            self.max_radius = max(self.max_radius, radius)
+        self.mm, self.created = mm, index["created"]
+        print(f"📦 Snapshot {path}: {len(self.geocodes)} geocodes, {sum(map(len, self.pending.values()))} place fetches")
+
+    def geocode(self, key):
+        entry = self.geocodes.get(key)
+        if not entry: return None
+        self.geocode_hits += 1
+        return entry[:2]
+
+    def unloaded(self):
+        # -> [(key, lat, lon, radius, expires, blob)] for fetches never promoted, still fresh
+        now = time.time()
+        with self.lock:
+            return [(key, lat, lon, radius, expires, self.mm[start:start + length])
+                    for entries in self.pending.values()
+                    for key, lat, lon, radius, _, expires, start, length in entries if expires > now]
+
+    def promote(self, lat, lon, radius, categories):
+        # Move every pending fetch whose circle covers this request into the
+        # local tiers; True if any did
+        if not self.pending: return False
+        now = time.time()
+        with self.lock:
+            found = []
+            for c in poi_store.cells_around(lat, lon, self.max_radius):
+                entries = self.pending.get(c)
+                if not entries: continue
+                hit = [e for e in entries if e[5] > now and all(category_within(w, e[4]) for w in categories)
+                       and haversine_km(lat, lon, e[1], e[2]) * 1000 + radius <= e[3]]
+                if not hit: continue
+                found += hit
+                rest = [e for e in entries if e not in hit and e[5] > now]
+                if rest: self.pending[c] = rest
+                else: del self.pending[c]
+            for key, clat, clon, cradius, ccats, expires, offset, length in found:
+                rows = unpack_rows(self.mm[offset:offset + length])
+                store_places(key, rows, clat, clon, key[2], cradius, ttl=expires - now)
+                self.promoted += 1
+        return bool(found)
+
+    def stats(self):
+        with self.lock:
+            return {"path": self.path, "created": self.created, "bytes": len(self.mm) if self.mm else 0,
+                    "geocodes": len(self.geocodes), "geocode_hits": self.geocode_hits,
+                    "places_pending": sum(map(len, self.pending.values())), "places_promoted": self.promoted}
+
+def write_snapshot(path):
+    # Save the live geocode LRU and places cache, plus the fresh entries of the
+    # loaded snapshot this process never used (their blobs are copied as they
+    # are); written beside the target and renamed over it, so a running app
+    # never maps a half-written file
+    now = time.time()
+    geocodes = {key: [key, lat, lon, expires] for key, (lat, lon), expires in geocode_cache.lru.items()}
+    for key, (lat, lon, expires) in snapshot.geocodes.items():
+        if expires > now: geocodes.setdefault(key, [key, lat, lon, expires])
+    geocodes = list(geocodes.values())
+    fetches = [(key, *cell_circle(key[0], key[1], key[3]), expires, pack_rows(rows)) for key, rows, expires in places_cache.items()]
+    live = {f[0] for f in fetches}
+    fetches += [(key, (lat, lon), radius, expires, blob) for key, lat, lon, radius, expires, blob in snapshot.unloaded() if key not in live]
+    places, blobs, offset = [], [], 0
+    for key, (lat, lon), radius, expires, blob in fetches:
+        places.append([list(key), lat, lon, radius, list(key[2]), expires, offset, len(blob)])
+        blobs.append(blob)
+        offset += len(blob)
+    index = json.dumps({"created": time.time(), "geocodes": geocodes, "places": places}, separators=(",", ":")).encode()
+    tmp = f"{path}.tmp"
+    with open(tmp, "wb") as f:
+        f.write(SNAPSHOT_MAGIC + len(index).to_bytes(8, "little") + index)
+        for blob in blobs: f.write(blob)
+    os.replace(tmp, path)
+    return {"geocodes": len(geocodes), "places": len(places), "bytes": os.path.getsize(path)}
+
+snapshot = Snapshot(SNAPSHOT_PATH)
+
+# ---------------- UPSTREAM HTTP ----------------
+
+class CircuitOpen(Exception):
+    pass
+
+class CircuitBreaker:
+    # closed -> open when too many recent calls failed or were slow. While open
+    # calls fail fast with CircuitOpen, so callers go straight to their fallbacks.
+    # After open_for seconds it is half-open: one probe call closes or reopens it.
+    # It also keeps recent latencies, which set the hedging delay.
+    def __init__(self, name, window, min_calls, failure_ratio, slow_call, open_for):
+        self.name = name
+        self.min_calls, self.failure_ratio, self.slow_call, self.open_for = min_calls, failure_ratio, slow_call, open_for
+        self.outcomes = deque(maxlen=window) # True for a failed or slow call
+        self.latencies = deque(maxlen=200)
+        self.state, self.opened_at, self.probing = "closed", 0.0, False
+        self.lock = threading.Lock()
+        self.counters = {"opened": 0, "short_circuited": 0, "probes": 0, "failures": 0, "slow": 0}
+
+    def allow(self):
+        with self.lock:
+            if self.state == "open" and time.monotonic() - self.opened_at >= self.open_for:
+                self.state = "half_open"
+            if self.state == "closed": return True
+            if self.state == "half_open" and not self.probing:
+                self.probing = True
+                self.counters["probes"] += 1
+                return True
+            self.counters["short_circuited"] += 1
+            return False
+
+    def record(self, ok, elapsed):
+        slow = elapsed > self.slow_call
+        with self.lock:
+            if ok: self.latencies.append(elapsed)
+            if not ok: self.counters["failures"] += 1
+            if slow: self.counters["slow"] += 1
+            if self.state == "half_open":
+                self.probing = False
+                if ok and not slow: self.state = "closed"
+                else: self._trip()
+                return
+            self.outcomes.append(not ok or slow)
+            if (self.state == "closed" and len(self.outcomes) >= self.min_calls
+                    and sum(self.outcomes) / len(self.outcomes) > self.failure_ratio):
+                self._trip()
+
+    def release(self):
+        # a call that ended without saying anything about the upstream (e.g. our own budget ran out)
+        with self.lock:
+            if self.state == "half_open": self.probing = False
+
+    def _trip(self):
+        self.state, self.opened_at = "open", time.monotonic()
+        self.outcomes.clear()
+        self.counters["opened"] += 1
+
+    def quantile(self, q):
+        with self.lock:
+            if len(self.latencies) < HTTP_HEDGE_MIN_SAMPLES: return None
+            ordered = sorted(self.latencies)
+        return ordered[int(q * (len(ordered) - 1))]
+
+    def stats(self):
+        with self.lock:
+            failing = sum(self.outcomes) / len(self.outcomes) if self.outcomes else 0.0
+            return dict(self.counters, state=self.state, failure_ratio=round(failing, 3))
+
+breakers = {} # host -> CircuitBreaker, shared by the sync and async clients
+
+def breaker_for(url):
+    host = urlsplit(url).netloc
+    breaker = breakers.get(host)
+    if breaker is None:
+        breaker = breakers.setdefault(host, CircuitBreaker(host, BREAKER_WINDOW, BREAKER_MIN_CALLS,
+                                                           BREAKER_FAILURE_RATIO, BREAKER_SLOW_CALL, BREAKER_OPEN_SECONDS))
+    return breaker
+
+def upstreams_healthy():
+    # plans built from fallbacks while a breaker is open are served but not cached
+    return all(b.state == "closed" for b in breakers.values())
+
+def hedge_delay(breaker, timeout):
+    # seconds to wait before hedging, or None to send a single request
+    if not HTTP_HEDGE or breaker.state != "closed": return None
+    p = breaker.quantile(HTTP_HEDGE_QUANTILE)
+    if p is None: return None
+    delay = max(HTTP_HEDGE_MIN_DELAY, p)
+    return delay if timeout is None or delay < timeout else None
+
+hedge_pool = ThreadPoolExecutor(max_workers=HTTP_HEDGE_WORKERS, thread_name_prefix="hedge")
+
+class HedgedGet:
+    # One GET on hedge_pool. began is when it left the pool's queue and was
+    # actually sent, so time queued behind other work is never taken for upstream latency.
+    def __init__(self, session, url, timeout, kwargs):
+        self.started, self.began = threading.Event(), None
+        self.future = hedge_pool.submit(self.run, session, url, timeout, kwargs)
+
+    def run(self, session, url, timeout, kwargs):
+        self.began = time.monotonic()
+        self.started.set()
+        return session.get(url, timeout=timeout, **kwargs)
+
+class RateLimited(Exception):
+    pass
+
+class TokenBucket:
+    # rate tokens per second, at most burst banked. Not thread-safe: owners lock.
+    def __init__(self, rate, burst):
+        self.rate, self.burst = rate, burst
+        self.tokens, self.stamp, self.paused_until = burst, time.monotonic(), 0.0
+
+    def refill(self, now):
+        start = max(self.stamp, self.paused_until)
+        if now > start:
+            self.tokens = min(self.burst, self.tokens + (now - start) * self.rate)
+            self.stamp = now
+
+    def take(self, now):
+        self.refill(now)
+        if now < self.paused_until or self.tokens < 1: return False
+        self.tokens -= 1
+        return True
+
+    def eta(self, now, ahead=0):
+        # seconds until a caller with `ahead` callers in front of it gets a token
+        return max(0.0, self.paused_until - now) + max(0.0, ahead + 1 - self.tokens) / self.rate
+
+    def pause(self, seconds, now):
+        # after a 429, spend nothing until the upstream's Retry-After has passed
+        self.tokens = 0
+        self.paused_until = max(self.paused_until, now + seconds)
+
+class RateLimiter:
+    # Token bucket for one upstream host shared by every thread, with a bounded
+    # priority queue: the lowest PRIORITIES value waiting gets the next token,
+    # first come first served within a priority.
+    def __init__(self, name, rate, burst, max_queue):
+        self.name, self.max_queue = name, max_queue
+        self.bucket = TokenBucket(rate, max(1.0, rate * burst))
+        self.cond = threading.Condition()
+        self.waiters = [] # heap of (priority value, seq)
+        self.seq = count()
+        self.counters = {"granted": 0, "queued": 0, "rejected": 0, "throttled": 0}
+        self.waited = self.max_waited = 0.0
+
+    def acquire(self, priority, max_wait):
+        # -> seconds waited; RateLimited when the queue is full or the wait would exceed max_wait
+        started = time.monotonic()
+        with self.cond:
+            if not self.waiters and self.bucket.take(started):
+                self.counters["granted"] += 1
+                metrics.observe("tripplanner_ratelimit_wait_seconds", 0.0, host=self.name, priority=priority)
+                return 0.0
+            entry = (PRIORITIES[priority], next(self.seq))
+            ahead = sum(1 for w in self.waiters if w < entry)
+            if len(self.waiters) >= self.max_queue or self.bucket.eta(started, ahead) > max_wait:
+                self.reject(priority, "queue full" if len(self.waiters) >= self.max_queue else "wait over budget")
+            heapq.heappush(self.waiters, entry)
+            self.counters["queued"] += 1
+            try:
+                while True:
+                    now = time.monotonic()
+                    head = self.waiters[0] == entry
+                    if head and self.bucket.take(now): break
+                    left = started + max_wait - now
+                    if left <= 0: self.reject(priority, "wait over budget")
+                    self.cond.wait(min(left, self.bucket.eta(now)) if head else left)
+            finally:
+                self.waiters.remove(entry)
+                heapq.heapify(self.waiters)
+                self.cond.notify_all()
+            waited = time.monotonic() - started
+            self.counters["granted"] += 1
+            self.waited += waited
+            self.max_waited = max(self.max_waited, waited)
+        metrics.observe("tripplanner_ratelimit_wait_seconds", waited, host=self.name, priority=priority)
+        return waited
+
+    def reject(self, priority, reason):
+        self.counters["rejected"] += 1
+        metrics.inc("tripplanner_ratelimit_rejected_total", host=self.name, priority=priority, reason=reason)
+        raise RateLimited(f"{self.name} rate limit: {reason}")
+
+    def throttled(self, retry_after):
+        # the upstream answered 429 anyway: hold every caller back
+        with self.cond:
+            self.counters["throttled"] += 1
+            self.bucket.pause(retry_after, time.monotonic())
+
+    def stats(self):
+        with self.cond:
+            by_priority = {name: sum(1 for p, _ in self.waiters if p == value) for name, value in PRIORITIES.items()}
+            granted = self.counters["granted"]
+            return dict(self.counters, rate=self.bucket.rate, queue_depth=len(self.waiters), queued_by_priority=by_priority,
+                        avg_wait=round(self.waited / granted, 4) if granted else 0.0, max_wait=round(self.max_waited, 4))
+
+limiters = {} # host -> RateLimiter, for hosts with a rate in RATE_LIMITS
+
+def limiter_for(url):
+    host = urlsplit(url).netloc
+    limiter = limiters.get(host)
+    if limiter is None and RATE_LIMITS.get(host):
+        limiter = limiters.setdefault(host, RateLimiter(host, RATE_LIMITS[host], RATE_LIMIT_BURST, RATE_LIMIT_QUEUE))
+    return limiter
+
+def retry_after_seconds(res, default=1.0):
+    value = res.headers.get("Retry-After")
+    return min(HTTP_BACKOFF_MAX, float(value)) if value and str(value).isdigit() else default
+
+def run_at_priority(priority, fn, *args):
+    # Runs fn in a copy of the current context with request_priority set
+    def call():
+        request_priority.set(priority)
+        return fn(*args)
+    return contextvars.copy_context().run(call)
+
+class UpstreamClient:
+    # One requests.Session shared by every thread. Each upstream host gets its
+    # own urllib3 pool, so TCP/TLS connections are kept alive and reused.
+    def __init__(self, pool_sizes, retries, backoff, backoff_max):
+        self.retries, self.backoff, self.backoff_max = retries, backoff, backoff_max
+        self.session = requests.Session()
+        for base_url, size in pool_sizes.items():
+            self.session.mount(base_url, HTTPAdapter(pool_connections=1, pool_maxsize=size))
+        self.lock = threading.Lock()
+        self.counters = {"requests": 0, "retries": 0, "errors": 0, "hedges": 0, "hedge_wins": 0}
+
+    def count(self, name):
+        with self.lock: self.counters[name] += 1
+
+    def get(self, url, timeout=None, **kwargs):
+        # Retries connection failures and 429/5xx with jittered exponential
+        # backoff. Read timeouts are not retried: they already cost a full timeout.
+        # Timeouts and retries never run past the request's deadline, and nothing
+        # is sent while the host's circuit breaker is open.
+        breaker, limiter = breaker_for(url), limiter_for(url)
+        for attempt in range(self.retries + 1):
+            limit = budget_timeout(timeout)
+            if not breaker.allow():
+                metrics.inc("tripplanner_upstream_errors_total", host=breaker.name, kind="circuit_open")
+                raise CircuitOpen(f"{breaker.name} circuit is open")
+            if limiter is not None:
+                try:
+                    limiter.acquire(request_priority.get(), budget_timeout(RATE_LIMIT_MAX_WAIT))
+                    limit = budget_timeout(timeout) # the wait came out of the budget
+                except (RateLimited, BudgetExceeded):
+                    breaker.release()
+                    metrics.inc("tripplanner_upstream_errors_total", host=breaker.name, kind="rate_limited")
+                    raise
+            self.count("requests")
+            metrics.gauge("tripplanner_upstream_in_flight", 1, host=breaker.name)
+            clock = [time.monotonic()] # send moves it to when the answering request was sent
+            try:
+                res = self.send(url, limit, breaker, clock, **kwargs)
+            except requests.ConnectionError:
+                breaker.record(False, time.monotonic() - clock[0])
+                self.count("errors")
+                metrics.inc("tripplanner_upstream_errors_total", host=breaker.name, kind="connection")
+                delay = backoff_delay(attempt, self.backoff, self.backoff_max)
+                if attempt == self.retries or not budget_allows(delay): raise
+            except requests.Timeout:
+                # a timeout shortened to fit the budget says nothing about the upstream
+                if limit == timeout: breaker.record(False, time.monotonic() - clock[0])
+                else: breaker.release()
+                metrics.inc("tripplanner_upstream_errors_total", host=breaker.name, kind="timeout")
+                raise
+            except Exception:
+                breaker.release()
+                metrics.inc("tripplanner_upstream_errors_total", host=breaker.name, kind="other")
+                raise
+            else:
+                ok = res.status_code not in HTTP_RETRY_STATUSES
+                breaker.record(ok, time.monotonic() - clock[0])
+                if ok: return res
+                if res.status_code == 429 and limiter is not None: limiter.throttled(retry_after_seconds(res))
+                self.count("errors")
+                metrics.inc("tripplanner_upstream_errors_total", host=breaker.name, kind=f"http_{res.status_code}")
+                delay = backoff_delay(attempt, self.backoff, self.backoff_max, res.headers.get("Retry-After"))
+                if attempt == self.retries or not budget_allows(delay): return res
+            finally:
+                metrics.gauge("tripplanner_upstream_in_flight", -1, host=breaker.name)
+                metrics.observe("tripplanner_upstream_request_seconds", time.monotonic() - clock[0], host=breaker.name)
+            self.count("retries")
+            metrics.inc("tripplanner_upstream_retries_total", host=breaker.name)
+            time.sleep(delay)
+
+    def send(self, url, timeout, breaker, clock, **kwargs):
+        # The hedge delay runs from when the first request was actually sent, and
+        # clock[0] ends up at the start of the request that answered. A losing
+        # hedge still queued is cancelled; one already sent is left to finish unmeasured.
+        delay = hedge_delay(breaker, timeout)
+        if delay is None: return self.session.get(url, timeout=timeout, **kwargs)
+        first = HedgedGet(self.session, url, timeout, kwargs)
+        first.started.wait()
+        clock[0] = first.began
+        try:
+            return first.future.result(timeout=delay)
+        except FutureTimeout:
+            self.count("hedges")
+            metrics.inc("tripplanner_upstream_hedges_total", host=breaker.name)
+        second = HedgedGet(self.session, url, timeout and timeout - delay, kwargs)
+        done, _ = wait((first.future, second.future), return_when=FIRST_COMPLETED)
+        winner = first if first.future in done else second
+        if winner.future.exception() is not None: winner = second if winner is first else first
+        (second if winner is first else first).future.cancel()
+        if winner is second:
+            self.count("hedge_wins")
+            metrics.inc("tripplanner_upstream_hedge_wins_total", host=breaker.name)
+        try:
+            return winner.future.result()
+        finally:
+            if winner.began is not None: clock[0] = winner.began
+
+    def stats(self):
+        hosts = {}
+        for adapter in set(self.session.adapters.values()):
+            pools = adapter.poolmanager.pools
+            for key in pools.keys():
+                pool = pools.get(key)
+                if pool is None: continue
+                h = hosts.setdefault(pool.host, {"requests": 0, "connections": 0})
+                h["requests"] += pool.num_requests
+                h["connections"] += pool.num_connections
+        for h in hosts.values():
+            h["reuse_ratio"] = round(1 - h["connections"] / h["requests"], 3) if h["requests"] else 0.0
+        with self.lock:
+            return dict(self.counters, hosts=hosts)
+
+class BudgetExceeded(Exception):
+    pass
+
+def budget_timeout(timeout):
+    # An upstream timeout capped to what is left of the current request's budget
+    deadline = request_deadline.get()
+    if deadline is None: return timeout
+    left = deadline - time.monotonic()
+    if left <= 0: raise BudgetExceeded("request budget exhausted")
+    return min(timeout, left) if timeout else left
+
+def budget_allows(seconds):
+    deadline = request_deadline.get()
+    return deadline is None or deadline - time.monotonic() > seconds
+
+def lookup_failed(what, e):
+    # Re-raises a failed upstream lookup, which must never pass for "no results".
+    # Out of budget becomes BudgetExceeded, so the section is reported as a timeout.
+    if not budget_allows(0): raise BudgetExceeded("request budget exhausted") from e
+    print(f"⚠️ {what} error:", e)
+    raise e
+
+def run_with_deadline(deadline, fn, *args):
+    # Runs fn in a copy of the current context with request_deadline set, so
+    # pool threads do not leak one request's deadline into the next task
+    def call():
+        request_deadline.set(deadline)
+        return fn(*args)
+    return contextvars.copy_context().run(call)
+
+def backoff_delay(attempt, backoff, backoff_max, retry_after=None):
+    if retry_after and str(retry_after).isdigit():
+        return min(backoff_max, float(retry_after))
+    return random.uniform(0, min(backoff_max, backoff * 2 ** attempt))
+
+http_client = UpstreamClient(HTTP_POOL_SIZES, HTTP_RETRIES, HTTP_BACKOFF, HTTP_BACKOFF_MAX)
+
+# ---------------- REQUEST COALESCING ----------------
+
+class SingleFlight:
+    # Concurrent calls with the same key share one execution of fn: the first
+    # caller runs it, the rest block until it finishes and get the same result.
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.calls = {}
+        self.counters = {"leaders": 0, "coalesced": 0}
+
+    def do(self, key, fn, *args):
+        with self.lock:
+            call = self.calls.get(key)
+            leader = call is None
+            if leader:
+                call = self.calls[key] = {"done": threading.Event(), "result": None, "error": None}
+            self.counters["leaders" if leader else "coalesced"] += 1
+        if not leader:
+            call["done"].wait()
+            if call["error"] is not None: raise call["error"]
+            return call["result"]
+        try:
+            call["result"] = fn(*args)
+            return call["result"]
+        except Exception as e:
+            call["error"] = e
+            raise
+        finally:
+            with self.lock: del self.calls[key]
+            call["done"].set()
+
+    def stats(self):
+        with self.lock:
+            return dict(self.counters, in_flight=len(self.calls))
+
+inflight = SingleFlight()
+
 # ---------------- HELPER FUNCTIONS ----------------
 
 def haversine_km(lat1, lon1, lat2, lon2):
@@ -18,133 +1528,660 @@ def haversine_km(lat1, lon1, lat2, lon2):
     return R * 2 * math.atan2(math.sqrt(a), math.sqrt(1 - a))
 
 def geoapify_geocode(place):
-    url = "https://api.geoapify.com/v1/geocode/search"
-    params = {"text": f"{place}, India", "apiKey": GEOAPIFY_KEY}
+    key = normalize_place(place)
+    if not key: return None, None
+    local = gazetteer.lookup(key) or geocode_cache.get(key) or snapshot.geocode(key)
+    suggester.planned(key)
+    if local: return local
+    if known_missing("geocode:" + key): return None, None
+    return inflight.do(("geocode", key), fetch_geocode, key, place)
+
+def fetch_geocode(key, place):
+    # another worker may be geocoding the same place: wait for its row instead
+    return host_once("geocode:" + key, partial(geocode_settled, key), partial(refresh_geocode, key, place))
+
+def geocode_settled(key):
+    # another worker's answer: its coordinates, or (None, None) if it found nothing
+    coords = geocode_cache.stored(key)
+    if coords is None and known_missing("geocode:" + key): return None, None
+    return coords
+
+def refresh_geocode(key, place):
+    lat, lon, suggest = geocode_upstream(place) # a failed lookup raises: nothing is remembered
+    if lat is None:
+        remember_missing("geocode:" + key)
+    else:
+        geocode_cache.put(key, lat, lon, suggest)
+        if suggest: suggester.add_region(key)
+    return lat, lon
+
+def geocode_upstream(place):
+    # -> (lat, lon, suggestable), lat None when nothing matched; raises when the
+    # lookup failed (circuit open, rate limited, out of budget, upstream error)
     try:
-        res = requests.get(url, params=params, timeout=10)
+        res = http_client.get(GEOCODE_URL, params=geocode_params(place), timeout=10)
         res.raise_for_status()
         data = res.json()
-        if "results" in data and data["results"]:
-            return float(data["results"][0]["lat"]), float(data["results"][0]["lon"])
-        elif "features" in data and data["features"]:
-            coords = data["features"][0]["geometry"]["coordinates"]
-            return float(coords[1]), float(coords[0])
+        return parse_geocode(data) + (geocode_suggestable(data),)
+    except BudgetExceeded:
+        raise
     except Exception as e:
-        print("❌ Geocode error:", e)
+        lookup_failed("Geocode", e)
+
+# Request building and response parsing are shared with the async app (app2_asgi.py)
+def geocode_params(place):
+    return {"text": f"{place}, {GEOCODE_COUNTRY}", "apiKey": GEOAPIFY_KEY}
+
+def parse_geocode(data):
+    if "results" in data and data["results"]:
+        return float(data["results"][0]["lat"]), float(data["results"][0]["lon"])
+    elif "features" in data and data["features"]:
+        coords = data["features"][0]["geometry"]["coordinates"]
+        return float(coords[1]), float(coords[0])
     return None, None
 
+def geocode_suggestable(data):
+    # True when the top match is a confident, place-like result, fit to offer other users
+    if data.get("results"): top = data["results"][0]
+    elif data.get("features"): top = data["features"][0].get("properties", {})
+    else: return False
+    return top.get("result_type") in SUGGEST_RESULT_TYPES and (top.get("rank") or {}).get("confidence", 0) >= SUGGEST_MIN_CONFIDENCE
+
 def geoapify_places(lat, lon, categories, radius=15000, limit=30):
-    url = "https://api.geoapify.com/v2/places"
-    params = {
+    key, (clat, clon), fetch_radius = places_cell(lat, lon, categories, radius, limit)
+    local = local_places(key, lat, lon, categories, radius, limit)
+    if local is not None: return local
+    rows = inflight.do(("places",) + key, fetch_places, key, clat, clon, categories, fetch_radius, limit)
+    return nearest_places(rows, lat, lon, radius, limit)
+
+def fetch_places(key, lat, lon, categories, radius, limit):
+    # the claiming worker fetches and publishes; the others pick its rows up from shared_rows
+    return host_once(shared_name(key), partial(settled_rows, key), partial(refresh_places, key, lat, lon, categories, radius, limit))
+
+def refresh_places(key, lat, lon, categories, radius, limit):
+    # a failed fetch raises, so it is neither cached nor remembered as empty
+    rows = places_upstream(lat, lon, categories, radius, limit * PLACES_FETCH_FACTOR)
+    store_places(key, rows, lat, lon, categories, radius)
+    publish_rows(key, rows, categories)
+    if not rows: remember_missing(shared_name(key))
+    return rows
+
+def places_upstream(lat, lon, categories, radius, limit):
+    try:
+        res = http_client.get(PLACES_URL, params=places_params(lat, lon, categories, radius, limit), timeout=15)
+        if res.status_code == 429: raise RateLimited("Geoapify answered 429")
+        res.raise_for_status()
+        return parse_places(res.json())
+    except (RateLimited, BudgetExceeded):
+        raise # out of quota or budget is not "no places here" either
+    except Exception as e:
+        lookup_failed("Geoapify", e)
+
+def places_params(lat, lon, categories, radius, limit):
+    return {
         "categories": ",".join(categories),
         "filter": f"circle:{lon},{lat},{radius}",
         "bias": f"proximity:{lon},{lat}",
         "limit": limit,
         "apiKey": GEOAPIFY_KEY
     }
-    try:
-        res = requests.get(url, params=params, timeout=15)
-        res.raise_for_status()
-        feats = res.json().get("features", [])
-        out = []
-        for f in feats:
-            p = f.get("properties", {})
-            if not p.get("name"): continue
-            # Geoapify might return coordinates in the properties or the geometry
-            latp = p.get("lat") or f["geometry"]["coordinates"][1]
-            lonp = p.get("lon") or f["geometry"]["coordinates"][0]
-            
-            # Standardized Map URL (using example for demonstration)
-            map_url = f"https://www.google.com/maps/search/?api=1&query={latp},{lonp}"
-
-            out.append({
-                "name": p["name"],
-                "address": p.get("formatted",""),
-                "map_url": map_url
-            })
-        return out
-    except Exception as e:
-        print("⚠️ Geoapify error:", e)
-        return []
+
+def parse_places(data):
+    out = []
+    for f in data.get("features", []):
+        p = f.get("properties", {})
+        if not p.get("name"): continue
+        # Geoapify might return coordinates in the properties or the geometry
+        latp = p.get("lat") or f["geometry"]["coordinates"][1]
+        lonp = p.get("lon") or f["geometry"]["coordinates"][0]
+        out.append(POI(p["name"], p.get("formatted",""), float(latp), float(lonp), tuple(p.get("categories", ()))))
+    return out
+
+WIKIPEDIA_HEADERS = {"User-Agent": "TripPlannerBot/1.0"}
 
 def wikipedia_fallback(region):
+    memo, pages = wikipedia_memo(region)
+    if pages is not None: return pages
+    try:
+        r = http_client.get(WIKIPEDIA_SEARCH_URL, params=wikipedia_params(region), headers=WIKIPEDIA_HEADERS, timeout=10)
+        r.raise_for_status()
+        pages = parse_wikipedia(r.json(), region)
+    except BudgetExceeded:
+        raise
+    except Exception as e:
+        lookup_failed("Wikipedia", e)
+    remember_wikipedia(memo, pages)
+    return pages
+
+def wikipedia_memo(region):
+    # -> (memo key, pages or None); pages are kept with the place lists, "no pages" negatively
+    memo = ("wikipedia", normalize_place(region))
+    pages = place_lists.get(memo)
+    if pages is None and known_missing(":".join(memo)): pages = PlaceList()
+    return memo, pages
+
+def remember_wikipedia(memo, pages):
+    if pages: place_lists.put(memo, pages)
+    else: remember_missing(":".join(memo))
+
+def wikipedia_params(region):
+    return {"q": f"Tourist attractions in {region} India", "limit": 10}
+
+def parse_wikipedia(data, region):
+    pages = data.get("pages", [])
+    return PlaceList(POI(p["title"], region, url=f"https://en.wikipedia.org/wiki/{p['title']}") for p in pages)
+
+fallback_steps = LRUCache(FALLBACK_ENTRIES, FALLBACK_TTL)
+
+def fallback_start(chain, lat, lon, mood):
+    # -> (memo key, step to start from, categories of the steps it skips) for a
+    # fallback chain in this places cell. The remembered step is checked again
+    # here: once a skipped step's negative entry expires, the chain starts over.
+    memo = (chain, math.floor(lat / PLACES_CELL_DEG), math.floor(lon / PLACES_CELL_DEG), mood)
+    found = fallback_steps.get(memo)
+    if found is not None and all(places_missing(lat, lon, categories) for categories in found[1]):
+        return memo, found[0], list(found[1])
+    return memo, "primary", []
+
+def settle_fallback(memo, start, step, lat, lon, tried):
+    # Start later next time only once every skipped step is known to be empty
+    # (a negative entry), never because a fetch failed
+    if step != start and all(places_missing(lat, lon, categories) for categories in tried):
+        fallback_steps.put(memo, (step, tuple(map(tuple, tried))))
+
+class SectionDegraded(Exception):
+    # A section answered from its fallback because an upstream lookup failed:
+    # the answer is served, but the section is reported as "error" and the
+    # plan is not cached.
+    def __init__(self, result, cause):
+        super().__init__(str(cause))
+        self.result = result
+
+def try_step(failed, fn, *args):
+    # one step of a fallback chain: its result, or [] with the error kept in `failed`
     try:
-        url = "https://en.wikipedia.org/w/rest.php/v1/search/title"
-        params = {"q": f"Tourist attractions in {region} India", "limit": 10}
-        headers = {"User-Agent": "TripPlannerBot/1.0"}
-        r = requests.get(url, params=params, headers=headers, timeout=10)
-        pages = r.json().get("pages", [])
-        return [{"name": p["title"], "address": region, "map_url": f"https://en.wikipedia.org/wiki/{p['title']}"} for p in pages]
-    except:
+        return fn(*args)
+    except BudgetExceeded:
+        raise
+    except Exception as e:
+        failed.append(e)
         return []
 
+def degraded(result, failed):
+    if failed: raise SectionDegraded(result, failed[0])
+    return result
+
 def mood_stays(lat, lon, mood):
     mood = mood.lower().strip()
+    price_range, mood_categories, broad_fallback_category = stay_options(mood)
+    memo, start, tried = fallback_start("stays", lat, lon, mood)
+    stays, step, failed = [], start, []
+
+    # --- 2. Execute Primary Search ---
+    if step == "primary":
+        with stage("stays_primary"):
+            stays = try_step(failed, geoapify_places, lat, lon, mood_categories)
+        if not stays: step, tried = "broad", tried + [mood_categories]
+    
+    # --- 3. Execute Fallback Search if needed ---
+    if step == "broad":
+        print(f"DEBUG: No specific '{mood}' stays found. Trying broad accommodation search.")
+        with stage("stays_fallback"):
+            stays = try_step(failed, geoapify_places, lat, lon, broad_fallback_category)
+        if not stays: step, tried = "default", tried + [broad_fallback_category]
+        
+    settle_fallback(memo, start, step, lat, lon, tried)
+    return degraded(finish_stays(stays, lat, lon, mood, price_range), failed)
 
+def stay_options(mood):
     # --- 1. Define Price Range and Categories (Corrected Logic) ---
-    if mood in ["relaxed", "cultural"]:
-        price_range = (5000, 25000) # High-Value: ₹5,000 to ₹25,000
-        mood_categories = {
-            "relaxed": ["accommodation.resort", "accommodation.hotel"],
-            "cultural": ["accommodation.home_stay", "accommodation.guest_house", "accommodation.apartment"]
-        }.get(mood)
-    else: 
-        price_range = (800, 7000) # Low-Value: ₹800 to ₹7,000
-        mood_categories = {
-            "adventurous": ["accommodation.hostel","camping"],
-            "spiritual": ["accommodation.lodge", "accommodation.guest_house"]
-        }.get(mood)
+    price_range = PRICE_TABLE.get(mood, DEFAULT_PRICE_RANGE)
+    mood_categories = {
+        "relaxed": ["accommodation.resort", "accommodation.hotel"],
+        "cultural": ["accommodation.home_stay", "accommodation.guest_house", "accommodation.apartment"],
+        "adventurous": ["accommodation.hostel","camping"],
+        "spiritual": ["accommodation.lodge", "accommodation.guest_house"]
+    }.get(mood)
     
     # Define a default category list for safety
     mood_categories = mood_categories or ["accommodation.hotel"] 
     broad_fallback_category = ["accommodation"] 
+    return price_range, mood_categories, broad_fallback_category
+
+def finish_stays(stays, lat, lon, mood, price_range):
+    # Priced stays are memoized on the places they came from, like the place lists
+    memo = ("stays", tuple(s.key() for s in stays[:5]), mood, tuple(price_range))
+    priced = place_lists.get(memo) if stays else None
+    if priced is not None: return priced
 
-    # --- 2. Execute Primary Search ---
-    stays = geoapify_places(lat, lon, mood_categories)
-    
-    # --- 3. Execute Fallback Search if needed ---
-    if not stays:
-        print(f"DEBUG: No specific '{mood}' stays found. Trying broad accommodation search.")
-        stays = geoapify_places(lat, lon, broad_fallback_category)
-        
     # --- 4. Apply Pricing and Tier Classification to all real results ---
-    for s in stays:
-        # Assign a random price within the MOOD's determined range
-        s["price_inr"] = random.randint(*price_range)
-        
-        # Assign Tier based on the price. Tiers are consistent regardless of mood.
-        if s["price_inr"] < 2500:
-            s["tier"] = "Budget"
-        elif s["price_inr"] < 10000:
-            s["tier"] = "Mid-range"
-        else:
-            s["tier"] = "Luxury"
+    # A stable price within the MOOD's range, seeded by the place itself.
+    # Tiers are consistent regardless of mood.
+    stays = PlaceList(Stay(s, price, price_tier(price)) for s in stays[:5]
+                      for price in [stable_price(price_range, s.name, s.lat, s.lon, mood)])
+    if stays: place_lists.put(memo, stays)
     
     # --- 5. Final Fallback if still no results (Very unlikely) ---
     if not stays: 
         print(f"DEBUG: Broad search also failed. Returning default stay.")
-        default_price = random.randint(*price_range)
-        default_tier = "Budget" if default_price < 2500 else "Mid-range" if default_price < 10000 else "Luxury"
-        stays = [{
-            "name": f"Default {mood.title()} Stay (No Geoapify Results)", 
-            "address": "City Center",
-            "price_inr": default_price,
-            "tier": default_tier,
-            "map_url": f"https://www.google.com/maps/search/?api=1&query={lat},{lon}"
-        }]
+        default_price = stable_price(price_range, "default", round(lat, 4), round(lon, 4), mood)
+        default_tier = price_tier(default_price)
+        center = POI(f"Default {mood.title()} Stay (No Geoapify Results)", "City Center",
+                     url=f"https://www.google.com/maps/search/?api=1&query={lat},{lon}")
+        stays = [Stay(center, default_price, default_tier)]
     
-    return stays[:5] # Limit to top 5 results
+    return stays # Limited to the top 5 results above
 
-def estimate_cost(days, avg_price):
+def stable_price(price_range, *seed):
+    # Uniform in [lo, hi] like random.randint, but a pure function of the seed
+    lo, hi = price_range
+    digest = hashlib.blake2b("|".join(map(str, seed)).encode(), digest_size=8).digest()
+    return lo + int.from_bytes(digest, "big") % (hi - lo + 1)
+
+def price_tier(price):
+    return "Budget" if price < 2500 else "Mid-range" if price < 10000 else "Luxury"
+
+def attraction_categories(mood):
+    # --- ATTRACTION LOGIC BASED ON MOOD ---
+    if mood == "spiritual":
+        return ["religion.place_of_worship"]
+    return ["tourism.attraction","leisure.park"]
+
+def mood_attractions(lat, lon, region, mood):
+    categories = attraction_categories(mood)
+    memo, start, _ = fallback_start("attractions", lat, lon, mood)
+    failed = []
+    if start == "primary":
+        found = try_step(failed, geoapify_places, lat, lon, categories)
+        if found: return found
+        settle_fallback(memo, start, "wikipedia", lat, lon, [categories])
+    return degraded(try_step(failed, wikipedia_fallback, region), failed)
+
+def fan_out(calls, deadline):
+    # calls: {name: (fn, args, default)} -> ({name: result}, {name: status}), all
+    # submitted at once and bounded by the request deadline (a time.monotonic()
+    # value). status is "ok", "timeout" when the default was used, or "error"
+    # with the default or the section's fallback answer.
+    results, status = {}, {}
+    for name, result, state in fan_out_iter(calls, deadline):
+        results[name] = result
+        status[name] = state
+    return results, status
+
+def fan_out_iter(calls, deadline):
+    # Same as fan_out, but yields (name, result, status) in completion order
+    # each call runs in a copy of this thread's context (request timings, deadline, priority)
+    pool = upstream_pool if request_priority.get() == "interactive" else background_pool
+    futures = {pool.submit(contextvars.copy_context().run, run_with_deadline, deadline, timed, name, fn, *args): name
+               for name, (fn, args, _) in calls.items()}
+    try:
+        for fut in as_completed(futures, timeout=max(0, deadline - time.monotonic())):
+            name = futures.pop(fut)
+            try:
+                yield name, fut.result(), "ok"
+            except BudgetExceeded:
+                print(f"⚠️ {name} lookup ran out of budget")
+                metrics.inc("tripplanner_section_failures_total", section=name, status="timeout")
+                yield name, calls[name][2], "timeout"
+            except SectionDegraded as e:
+                print(f"⚠️ {name} lookup failed, using its fallback:", e)
+                metrics.inc("tripplanner_section_failures_total", section=name, status="error")
+                yield name, e.result, "error"
+            except Exception as e:
+                print(f"⚠️ {name} lookup failed:", e)
+                metrics.inc("tripplanner_section_failures_total", section=name, status="error")
+                yield name, calls[name][2], "error"
+    except FutureTimeout:
+        for fut, name in futures.items():
+            print(f"⚠️ {name} lookup ran out of budget")
+            metrics.inc("tripplanner_section_failures_total", section=name, status="timeout")
+            fut.cancel()
+            yield name, calls[name][2], "timeout"
+
+def estimate_cost(days, avg_price, seed=()):
     food = round(avg_price*0.3)
-    travel = random.randint(500,2000)
+    travel = stable_price(TRAVEL_PRICE_RANGE, "travel", *seed)
     return {
         "stay_per_day": avg_price,
         "food_per_day": food,
         "travel_per_day": travel,
         "total_inr": (avg_price+food+travel)*days
     }
+
+def parse_trip_request(d):
+    # ValueError (a 400) for days outside 1..MAX_TRIP_DAYS, like a non-numeric value
+    days = int(d.get("days",3))
+    if not 1 <= days <= MAX_TRIP_DAYS: raise ValueError(f"days must be between 1 and {MAX_TRIP_DAYS}")
+    return d.get("region"), days, d.get("mood","relaxed").lower()
+
+def build_plan(region, days, mood, lat, lon, stays, attractions, restaurants, sections=None):
+    # Calculate average cost for budget estimation
+    # Use the price from the single default stay, or a safe default
+    avg = 4000 
+    if stays:
+        if not stays[0].name.startswith("Default"):
+             avg = int(sum(s.price_inr for s in stays)/len(stays))
+        else:
+             avg = stays[0].price_inr
+        
+    with stage("cost"):
+        cost = estimate_cost(days, avg, (round(lat, 4), round(lon, 4), mood))
+    with stage("itinerary"):
+        itinerary = plan_itinerary(attractions, days, stay_base(stays, lat, lon))
+    
+    return {
+        "region": region, "coordinates":{"lat":lat,"lon":lon},
+        "mood": mood, "days": days,
+        "stays": stays, 
+        "attractions": attractions,
+        "restaurants": restaurants,
+        "estimated_cost": cost,
+        "itinerary": itinerary,
+        # per-section "ok" / "timeout" / "error"; partial when any lookup missed the budget or failed
+        "partial": any(v != "ok" for v in (sections or {}).values()),
+        "sections": sections or {}
+    }
+
+def stay_base(stays, lat, lon):
+    # Day trips start and end at the first stay, or the region centre without one
+    for s in stays[:1]:
+        if s.lat is not None: return s.lat, s.lon
+    return lat, lon
+
+def plan_one(region, days, mood, coords=None, budget=PLAN_BUDGET):
+    # -> (status, payload, complete); coords skips the geocode when the caller
+    # already has it. complete is False when a section missed the budget or failed.
+    deadline = time.monotonic() + budget
+    try:
+        lat, lon = coords or run_with_deadline(deadline, timed, "geocode", geoapify_geocode, region)
+    except Exception as e:
+        return (*geocode_failure(deadline, e), False)
+    if not lat: return (*geocode_failure(deadline), False)
     
+    # --- INDEPENDENT LOOKUPS GO OUT CONCURRENTLY ---
+    found, status = fan_out(plan_calls(lat, lon, region, mood), deadline)
+    sections = dict(coordinates="ok", **status)
+    payload = build_plan(region, days, mood, lat, lon,
+                         found["stays"], found["attractions"], found["restaurants"], sections)
+    return 200, payload, not payload["partial"]
+
+def geocode_failure(deadline, error=None):
+    # -> (status, payload) for a plan that never got coordinates: 504 out of
+    # budget, 503 when the geocoder could not be asked, 400 when it found no such place
+    if isinstance(error, BudgetExceeded) or time.monotonic() >= deadline:
+        return 504, {"error":"Planning budget exceeded", "partial": True, "sections": {"coordinates": "timeout"}}
+    if error is not None:
+        return 503, {"error":"Geocoding is unavailable, try again shortly", "partial": True, "sections": {"coordinates": "error"}}
+    return 400, {"error":"Could not geocode region"}
+
+def plan_calls(lat, lon, region, mood):
+    calls = {
+        "attractions": (mood_attractions, (lat, lon, region, mood), []),
+        "stays": (mood_stays, (lat, lon, mood), []),
+        "restaurants": (geoapify_places, (lat, lon, RESTAURANT_CATEGORIES), []),
+    }
+    if PLACES_CONSOLIDATED:
+        calls = {name: (after_prefetch, (lat, lon, mood, fn) + args, default) for name, (fn, args, default) in calls.items()}
+    return calls
+
+def after_prefetch(lat, lon, mood, fn, *args):
+    prefetch_places(lat, lon, mood)
+    return fn(*args)
+
+def prefetch_places(lat, lon, mood):
+    # One places query for every category of the plan. The sections call this
+    # concurrently and share one fetch through singleflight. The rows land in the
+    # POI store as covering the whole union, so each section's own
+    # geoapify_places call is then answered locally, split by feature categories.
+    # On failure the sections fall back to fetching on their own.
+    try:
+        with stage("places_union"):
+            geoapify_places(lat, lon, plan_categories(mood), limit=PLACES_UNION_LIMIT)
+    except Exception as e:
+        print("⚠️ Consolidated places fetch failed:", e)
+
+def plan_categories(mood):
+    # every category a plan can ask for (stays fallback included), minus those
+    # already inside a broader one: "accommodation" covers "accommodation.hotel"
+    _, mood_categories, broad = stay_options(mood.lower().strip())
+    wanted = set(attraction_categories(mood) + mood_categories + broad + RESTAURANT_CATEGORIES)
+    return sorted(c for c in wanted if not any(c != p and category_within(c, [p]) for p in wanted))
+
+# ---------------- STREAMING ----------------
+
+def plan_sections(region, days, mood):
+    # Yields (section, data) as each part of the plan is ready: the request echo,
+    # coordinates, then stays/attractions/restaurants in completion order, and
+    # finally estimated_cost and itinerary. Ends with "done" or "error". Shares
+    # the plan cache with cached_plan: a hit is replayed, a complete plan stored.
+    key = plan_cache_key(region, days, mood)
+    hit = plan_cache.get(key)
+    if hit is not None:
+        yield from cached_sections(hit[0])
+        return
+    deadline = time.monotonic() + PLAN_BUDGET
+    yield "plan", {"region": region, "mood": mood, "days": days}
+    try:
+        lat, lon = run_with_deadline(deadline, timed, "geocode", geoapify_geocode, region)
+    except Exception as e:
+        yield "error", geocode_failure(deadline, e)[1]
+        return
+    if not lat:
+        yield "error", geocode_failure(deadline)[1]
+        return
+    yield "coordinates", {"lat": lat, "lon": lon}
+    found, sections = {}, {"coordinates": "ok"}
+    for name, result, state in fan_out_iter(plan_calls(lat, lon, region, mood), deadline):
+        found[name], sections[name] = result, state
+        yield name, result
+    plan = build_plan(region, days, mood, lat, lon, found["stays"], found["attractions"], found["restaurants"], sections)
+    yield "estimated_cost", plan["estimated_cost"]
+    yield "itinerary", plan["itinerary"]
+    remember_plan(key, 200, plan, not plan["partial"])
+    yield "done", {"partial": plan["partial"], "sections": sections}
+
+def cached_sections(body):
+    # a cached plan body as plan_sections would have streamed it
+    plan = json_loads(body)
+    yield "plan", {"region": plan["region"], "mood": plan["mood"], "days": plan["days"]}
+    yield "coordinates", plan["coordinates"]
+    for section in ("stays", "attractions", "restaurants", "estimated_cost", "itinerary"):
+        yield section, plan[section]
+    yield "done", {"partial": plan["partial"], "sections": plan["sections"]}
+
+STREAM_FORMATS = {"ndjson": "application/x-ndjson", "sse": "text/event-stream"}
+
+def stream_format(requested, accept):
+    # ?stream=ndjson|sse, or an Accept header naming one of the stream types
+    if requested in STREAM_FORMATS: return requested
+    for fmt, mimetype in STREAM_FORMATS.items():
+        if mimetype in (accept or ""): return fmt
+    return None
+
+def encode_section(fmt, section, data):
+    if fmt == "sse":
+        return f"event: {section}\ndata: {json_dumps(data)}\n\n"
+    return json_dumps({"section": section, "data": data}) + "\n"
+
+# ---------------- RESPONSE CACHE ----------------
+
+plan_cache = LRUCache(PLAN_CACHE_ENTRIES, PLAN_CACHE_TTL)
+
+def plan_cache_key(region, days, mood):
+    # the region and mood exactly as the plan echoes them, so a hit never
+    # answers one spelling with another request's
+    return region, days, mood
+
+def encode_plan(payload):
+    # -> (body, etag); the ETag is a hash of the exact bytes served
+    body = json_bytes(payload)
+    return body, '"' + hashlib.blake2b(body, digest_size=16).hexdigest() + '"'
+
+def cached_plan(region, days, mood):
+    # -> (status, body, etag); only complete 200 plans are cached
+    key = plan_cache_key(region, days, mood)
+    hit = plan_cache.get(key)
+    if hit is not None: return (200,) + hit
+    status, payload, complete = plan_one(region, days, mood)
+    return (status,) + remember_plan(key, status, payload, complete)
+
+def remember_plan(key, status, payload, complete):
+    # -> (body, etag); a plan is cached only when complete and built while every
+    # upstream was healthy. A partial plan gets no ETag: clients must not keep it either.
+    body, etag = encode_plan(payload)
+    if status == 200 and complete and upstreams_healthy(): plan_cache.put(key, (body, etag))
+    return body, etag if complete else None
+
+def plan_headers(etag):
+    # a plan without an ETag is partial, so no browser or proxy may reuse it
+    if etag is None: return {"Cache-Control": "no-store"}
+    return {"ETag": etag, "Cache-Control": f"public, max-age={PLAN_CACHE_TTL}"}
+
+def etag_matches(if_none_match, etag):
+    if not if_none_match or etag is None: return False
+    tags = [t.strip() for t in if_none_match.split(",")]
+    return "*" in tags or etag in tags or "W/" + etag in tags
+
+# ---------------- ITINERARY ----------------
+
+def plan_itinerary(stops, days, base):
+    # Splits the stops into `days` geographic groups and orders each day as a
+    # round trip from `base`: nearest neighbour, then 2-opt, over one shared
+    # distance matrix. Stops without coordinates (Wikipedia) are left out.
+    placed = [s for s in stops if s.lat is not None and s.lon is not None]
+    if not placed or days < 1: return []
+    dist = distance_matrix([base] + [(s.lat, s.lon) for s in placed])
+    groups = cluster_stops(placed, min(days, len(placed)))
+    groups.sort(key=lambda g: min(dist[0][i + 1] for i in g)) # closest area first
+
+    itinerary = []
+    for d in range(days):
+        members = groups[d] if d < len(groups) else []
+        tour = order_day([0] + [i + 1 for i in members], dist)
+        day_stops, total = [], 0.0
+        for prev, node in zip(tour, tour[1:]):
+            total += dist[prev][node]
+            day_stops.append(dict(placed[node - 1].to_dict(), leg_km=round(dist[prev][node], 2)))
+        if day_stops: total += dist[tour[-1]][0]
+        itinerary.append({"day": d + 1, "stops": day_stops, "distance_km": round(total, 2)})
+    return itinerary
+
+def distance_matrix(points):
+    lats = [p[0] for p in points]
+    lons = [p[1] for p in points]
+    if np is not None:
+        la, lo = np.radians(lats), np.radians(lons)
+        a = np.sin((la[:, None] - la[None, :]) / 2)**2 \
+            + np.cos(la[:, None]) * np.cos(la[None, :]) * np.sin((lo[:, None] - lo[None, :]) / 2)**2
+        return (6371.0 * 2 * np.arctan2(np.sqrt(a), np.sqrt(1 - a))).tolist()
+    n = len(points)
+    dist = [[0.0] * n for _ in range(n)]
+    for i in range(n):
+        for j in range(i + 1, n):
+            dist[i][j] = dist[j][i] = haversine_km(lats[i], lons[i], lats[j], lons[j])
+    return dist
+
+def cluster_stops(stops, k, rounds=6):
+    # Balanced k-means on an equirectangular projection: every group gets at
+    # least one stop and at most ceil(n / k), so no day is overloaded.
+    n = len(stops)
+    scale = math.cos(math.radians(sum(s.lat for s in stops) / n))
+    pts = [(s.lon * scale, s.lat) for s in stops]
+    sq = lambda a, b: (a[0] - b[0])**2 + (a[1] - b[1])**2
+
+    # deterministic farthest-first seeding, starting next to the mean
+    mean = (sum(p[0] for p in pts) / n, sum(p[1] for p in pts) / n)
+    centers = [min(pts, key=lambda p: sq(p, mean))]
+    near = [sq(p, centers[0]) for p in pts]
+    while len(centers) < k:
+        far = max(range(n), key=near.__getitem__)
+        centers.append(pts[far])
+        fx, fy = pts[far]
+        near = [min(m, (x - fx)**2 + (y - fy)**2) for m, (x, y) in zip(near, pts)]
+
+    cap = math.ceil(n / k)
+    assign = None
+    for _ in range(rounds):
+        # (stop, centre) pairs, nearest first
+        if np is not None:
+            P, C = np.array(pts), np.array(centers)
+            order = np.argsort(((P[:, None, :] - C[None, :, :])**2).sum(-1), axis=None, kind="stable")
+            pairs = list(zip((order // k).tolist(), (order % k).tolist()))
+        else:
+            pairs = [(i, c) for _, i, c in sorted((sq(pts[i], centers[c]), i, c) for i in range(n) for c in range(k))]
+        groups = [[] for _ in range(k)]
+        taken = [False] * n
+        # every centre first claims one stop, then the rest fill up to cap
+        for i, c in pairs:
+            if not taken[i] and not groups[c]:
+                groups[c].append(i); taken[i] = True
+        for i, c in pairs:
+            if not taken[i] and len(groups[c]) < cap:
+                groups[c].append(i); taken[i] = True
+        if groups == assign: break
+        assign = groups
+        centers = [(sum(pts[i][0] for i in g) / len(g), sum(pts[i][1] for i in g) / len(g)) for g in groups]
+    return assign
+
+def order_day(nodes, dist):
+    # Round trip through nodes starting at nodes[0]: nearest neighbour, then 2-opt
+    tour, rest = [nodes[0]], set(nodes[1:])
+    while rest:
+        nxt = min(rest, key=lambda j: dist[tour[-1]][j])
+        tour.append(nxt); rest.remove(nxt)
+    m = len(tour)
+    improved = m > 3
+    while improved:
+        improved = False
+        for i in range(1, m - 1):
+            for j in range(i + 1, m):
+                a, b, c, d = tour[i - 1], tour[i], tour[j], tour[(j + 1) % m]
+                if dist[a][c] + dist[b][d] < dist[a][b] + dist[c][d] - 1e-9:
+                    tour[i:j + 1] = reversed(tour[i:j + 1])
+                    improved = True
+    return tour
+
+# ---------------- BATCH PLANNING ----------------
+
+def plan_trips(trips, workers=BATCH_WORKERS, priority="batch"):
+    # Plans many trips, yielding (index, status, payload) as each one finishes.
+    # trips are dicts like the /plan_trip body or (region, days, mood) tuples.
+    # Each distinct region is geocoded once up front. Places lookups for the
+    # same cell and category set are shared through the places cache and singleflight.
+    # Upstream calls queue behind interactive traffic at the given priority.
+    parsed = {}
+    for i, t in enumerate(trips):
+        try:
+            parsed[i] = parse_trip_request(t if isinstance(t, dict) else dict(zip(("region", "days", "mood"), t)))
+        except (TypeError, ValueError, AttributeError) as e:
+            yield i, 400, {"error": f"Invalid trip: {e}"}
+
+    # Not a with block: when the consumer goes away (a streaming client
+    # disconnects), the trips not yet started are dropped instead of being planned
+    # on upstream quota nobody will see
+    pool = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="batch")
+    try:
+        regions = {normalize_place(region): region for region, _, _ in parsed.values()}
+        coords = dict(zip(regions, pool.map(partial(run_at_priority, priority, batch_geocode), regions.values())))
+        futures = {pool.submit(run_at_priority, priority, plan_one, region, days, mood, coords[normalize_place(region)]): i
+                   for i, (region, days, mood) in parsed.items()}
+        for fut in as_completed(futures):
+            try:
+                status, payload, _ = fut.result()
+            except Exception as e:
+                print("⚠️ Batch item failed:", e)
+                status, payload = 500, {"error": "Planning failed"}
+            yield futures[fut], status, payload
+    finally:
+        pool.shutdown(wait=False, cancel_futures=True)
+
+def batch_geocode(region):
+    # a failed lookup is left to plan_one, which tries again and reports it
+    try:
+        return geoapify_geocode(region)
+    except Exception:
+        return None
+
 # ---------------- FLASK ROUTES ----------------
 
 # HTML Content (Combined Frontend - NO CHANGES HERE)
@@ -563,7 +2600,8 @@ input:focus, select:focus {
     <p class="page-subtitle">Choose your destination in India</p>
     <div class="input-group">
       <div class="input-label">City or Region</div>
-      <input type="text" id="region" placeholder="e.g. Goa, Rishikesh, Jaipur">
+      <input type="text" id="region" placeholder="e.g. Goa, Rishikesh, Jaipur" list="regionSuggestions" autocomplete="off">
+      <datalist id="regionSuggestions"></datalist>
     </div>
     <button class="btn" onclick="nextFromRegion()">Next →</button>
     <div id="regionError"></div>
@@ -633,6 +2671,29 @@ function goToPage(pageId) {
   document.getElementById(pageId).classList.add('active');
 }
 
+// Region autocomplete: ask /suggest once typing pauses, dropping stale answers
+let suggestTimer = null, suggestAbort = null;
+document.getElementById('region').addEventListener('input', (e) => {
+  clearTimeout(suggestTimer);
+  const q = e.target.value.trim();
+  if (!q) return;
+  suggestTimer = setTimeout(async () => {
+    if (suggestAbort) suggestAbort.abort();
+    suggestAbort = new AbortController();
+    try {
+      const res = await fetch('/suggest?q=' + encodeURIComponent(q), { signal: suggestAbort.signal });
+      const data = await res.json();
+      const list = document.getElementById('regionSuggestions');
+      list.innerHTML = '';
+      (data.suggestions || []).forEach(s => {
+        const opt = document.createElement('option');
+        opt.value = s.name;
+        list.appendChild(opt);
+      });
+    } catch (err) { /* aborted or offline: keep the last suggestions */ }
+  }, 150);
+});
+
 function nextFromRegion() {
   const region = document.getElementById('region').value.trim();
   const errorDiv = document.getElementById('regionError');
@@ -677,8 +2738,8 @@ async function planTrip() {
   errorDiv.innerHTML = '';
 
   try {
-    // API call to the Flask backend
-    const res = await fetch('/plan_trip', {
+    // API call to the Flask backend, streamed: one NDJSON line per finished section
+    const res = await fetch('/plan_trip?stream=ndjson', {
       method: 'POST',
       headers: {'Content-Type': 'application/json'},
       body: JSON.stringify(tripData)
@@ -690,9 +2751,54 @@ async function planTrip() {
       return;
     }
 
-    const data = await res.json();
-    displayResults(data);
-    goToPage('resultsPage');
+    const data = {pending: ['stays', 'attractions', 'restaurants', 'estimated_cost']};
+    const reader = res.body.getReader();
+    const decoder = new TextDecoder();
+    let buffer = '';
+    let shown = false, finished = false;
+    while (true) {
+      const {done, value} = await reader.read();
+      if (done) break;
+      buffer += decoder.decode(value, {stream: true});
+      let nl;
+      while ((nl = buffer.indexOf('\\n')) >= 0) {
+        const line = buffer.slice(0, nl).trim();
+        buffer = buffer.slice(nl + 1);
+        if (!line) continue;
+        const event = JSON.parse(line);
+        if (event.section === 'error') {
+          errorDiv.innerHTML = `<div class="error-msg">❌ Server error: ${event.data.error}</div>`;
+          return;
+        }
+        if (event.section === 'plan') {
+          Object.assign(data, event.data);
+        } else if (event.section === 'done') {
+          // per-section "timeout" / "error": those sections show fallbacks or nothing
+          finished = true;
+          const failed = Object.entries(event.data.sections || {}).filter(([, state]) => state !== 'ok');
+          if (failed.length) data.notice = `⚠ Some sections could not be loaded: ${failed.map(([s, state]) => `${s} (${state})`).join(', ')}`;
+        } else {
+          data[event.section] = event.data;
+          data.pending = data.pending.filter(s => s !== event.section);
+        }
+        if (data.coordinates) {
+          displayResults(data);
+          if (!shown) { goToPage('resultsPage'); shown = true; }
+        }
+      }
+    }
+
+    // the stream ended without "done" (proxy cut, server error): stop waiting on what never came
+    if (!finished) {
+      const missing = data.pending;
+      data.pending = [];
+      if (!shown) {
+        errorDiv.innerHTML = '<div class="error-msg">❌ Server error: the plan was cut off, please try again</div>';
+        return;
+      }
+      data.notice = `❌ The plan was cut off before it finished${missing.length ? ': missing ' + missing.join(', ') : ''}. Please try again.`;
+      displayResults(data);
+    }
 
   } catch (e) {
     errorDiv.innerHTML = `<div class="error-msg">❌ Connection error: ${e.message}</div>`;
@@ -710,6 +2816,7 @@ function displayResults(data) {
       <p style="font-size:1em;margin-top:10px;opacity:0.9">📍 ${data.coordinates.lat}, ${data.coordinates.lon}</p>
     </div>
   `;
+  if (data.notice) html += `<div class="error-msg">${data.notice}</div>`;
 
   if (data.stays && data.stays.length > 0) {
     html += '<div class="section"><h3>🏨 Accommodations</h3>';
@@ -727,6 +2834,8 @@ function displayResults(data) {
       `;
     });
     html += '</div>';
+  } else if (isPending(data, 'stays')) {
+    html += loadingSection('🏨 Accommodations');
   }
 
   if (data.attractions && data.attractions.length > 0) {
@@ -741,6 +2850,23 @@ function displayResults(data) {
       `;
     });
     html += '</div>';
+  } else if (isPending(data, 'attractions')) {
+    html += loadingSection('🎯 Top Attractions');
+  }
+
+  if (data.itinerary && data.itinerary.length > 0) {
+    html += '<div class="section"><h3>🗓 Day-by-Day Plan</h3>';
+    data.itinerary.forEach(d => {
+      const names = d.stops.length ? d.stops.map(s => s.name).join(' → ') : 'Free day';
+      html += `
+        <div class="item">
+          <div class="item-name">Day ${d.day}</div>
+          <div class="item-details">${names}</div>
+          <span class="item-price">🚗 ${d.distance_km} km</span>
+        </div>
+      `;
+    });
+    html += '</div>';
   }
 
   if (data.restaurants && data.restaurants.length > 0) {
@@ -755,6 +2881,8 @@ function displayResults(data) {
       `;
     });
     html += '</div>';
+  } else if (isPending(data, 'restaurants')) {
+    html += loadingSection('🍽 Recommended Restaurants');
   }
 
   if (data.estimated_cost) {
@@ -766,11 +2894,22 @@ function displayResults(data) {
         </div>
       </div>
     `;
+  } else if (isPending(data, 'estimated_cost')) {
+    html += loadingSection('💰 Estimated Cost');
   }
 
   document.getElementById('resultsContent').innerHTML = html;
 }
 
+// Sections still on their way when results are streamed in
+function isPending(data, section) {
+  return Array.isArray(data.pending) && data.pending.includes(section);
+}
+
+function loadingSection(title) {
+  return `<div class="section"><h3>${title}</h3><div class="item"><div class="item-details">⏳ Loading...</div></div></div>`;
+}
+
 document.getElementById('region').addEventListener('keypress', (e) => {
   if (e.key === 'Enter') nextFromRegion();
 });
@@ -784,53 +2923,168 @@ document.getElementById('days').addEventListener('keypress', (e) => {
 </html>
 """
 
+# Cache counters
+@app.route("/stats")
+def stats():
+    return jsonify(stats_payload())
+
+@app.route("/metrics")
+def metrics_route():
+    return Response(metrics_text(), mimetype="text/plain; version=0.0.4")
+
+def metrics_text(extra=()):
+    # registry series plus cache, breaker and coalescing state read at scrape time
+    s = stats_payload()
+    series = list(extra)
+    for cache, st in (("gazetteer", s["gazetteer"]), ("geocode", s["geocode_cache"]),
+                      ("places", s["places_cache"]), ("shared", s["shared_cache"]), ("negative", s["negative_cache"]),
+                      ("plan", s["plan_cache"])):
+        hits = st["hits"] # gazetteer hits already include its fuzzy matches
+        total = hits + st["misses"]
+        series += [("tripplanner_cache_hits_total", "counter", {"cache": cache}, hits),
+                   ("tripplanner_cache_misses_total", "counter", {"cache": cache}, st["misses"]),
+                   ("tripplanner_cache_hit_ratio", "gauge", {"cache": cache}, round(hits / total, 4) if total else 0)]
+    series.append(("tripplanner_gazetteer_fuzzy_hits_total", "counter", {}, s["gazetteer"]["fuzzy_hits"]))
+    for host, b in s["breakers"].items():
+        series.append(("tripplanner_circuit_state", "gauge", {"host": host}, ("closed", "half_open", "open").index(b["state"])))
+    for host, l in s["rate_limits"].items():
+        series += [("tripplanner_ratelimit_queue_depth", "gauge", {"host": host, "priority": p}, n)
+                   for p, n in l["queued_by_priority"].items()]
+    series += [("tripplanner_poi_store_pois", "gauge", {}, s["poi_store"]["pois"]),
+               ("tripplanner_place_lists_entries", "gauge", {}, s["place_lists"]["size"]),
+               ("tripplanner_snapshot_places_pending", "gauge", {}, s["snapshot"]["places_pending"]),
+               ("tripplanner_snapshot_places_promoted_total", "counter", {}, s["snapshot"]["places_promoted"]),
+               ("tripplanner_singleflight_in_flight", "gauge", {"app": "sync"}, s["singleflight"]["in_flight"])]
+    return metrics.render(series)
+
+# Per-request latency metrics and the Server-Timing header (stages recorded by stage())
+@app.before_request
+def start_timing():
+    g.started = time.perf_counter()
+    request_timings.set([])
+    metrics.gauge("tripplanner_http_in_flight", 1)
+
+@app.after_request
+def finish_timing(response):
+    elapsed = time.perf_counter() - g.started
+    route = request.url_rule.rule if request.url_rule else "unmatched"
+    metrics.observe("tripplanner_http_request_seconds", elapsed, route=route, method=request.method)
+    metrics.inc("tripplanner_http_responses_total", route=route, status=response.status_code)
+    # streamed bodies are produced after the headers go out
+    if not response.is_streamed: response.headers["Server-Timing"] = server_timing(request_timings.get(), elapsed)
+    return response
+
+@app.teardown_request
+def end_timing(exc):
+    metrics.gauge("tripplanner_http_in_flight", -1)
+    request_timings.set(None)
+
+def stats_payload():
+    return {"gazetteer": gazetteer.stats(), "geocode_cache": geocode_cache.stats(), "places_cache": places_cache.stats(),
+            "shared_cache": shared_cache.stats(), "suggest": suggester.stats(),
+            "negative_cache": negatives.stats(), "fallback_steps": fallback_steps.stats(),
+            "poi_store": poi_store.stats(), "snapshot": snapshot.stats(), "place_lists": place_lists.stats(),
+            "http": http_client.stats(), "breakers": {host: b.stats() for host, b in breakers.items()},
+            "rate_limits": {host: l.stats() for host, l in limiters.items()},
+            "singleflight": inflight.stats(), "plan_cache": plan_cache.stats()}
+
+def build_index_variants(html):
+    # encoding -> (body, etag); each representation gets its own strong ETag
+    raw = html.encode()
+    tag = hashlib.blake2b(raw, digest_size=16).hexdigest()
+    variants = {
+        "identity": (raw, f'"{tag}"'),
+        "gzip": (gzip.compress(raw, 9, mtime=0), f'"{tag}-gz"'),
+    }
+    if brotli is not None:
+        variants["br"] = (brotli.compress(raw, quality=11), f'"{tag}-br"')
+    return variants
+
+INDEX_VARIANTS = build_index_variants(HTML_CONTENT)
+
+def accepted_encoding(accept_encoding, available):
+    # Best of br > gzip the client accepts (q > 0), else identity
+    q = {}
+    for part in (accept_encoding or "").lower().split(","):
+        name, _, params = part.strip().partition(";")
+        weight = 1.0
+        if params.strip().startswith("q="):
+            try: weight = float(params.strip()[2:])
+            except ValueError: weight = 0.0
+        q[name.strip()] = weight
+    for enc in ("br", "gzip"):
+        if enc in available and q.get(enc, q.get("*", 0)) > 0: return enc
+    return "identity"
+
+def index_response_parts(accept_encoding, if_none_match):
+    # -> (status, body, headers) for "/", shared with the ASGI app
+    enc = accepted_encoding(accept_encoding, INDEX_VARIANTS)
+    body, etag = INDEX_VARIANTS[enc]
+    headers = {"ETag": etag, "Cache-Control": f"public, max-age={INDEX_MAX_AGE}", "Vary": "Accept-Encoding"}
+    if enc != "identity": headers["Content-Encoding"] = enc
+    if etag_matches(if_none_match, etag): return 304, b"", headers
+    return 200, body, headers
+
+def suggest_payload(args):
+    # -> (status, payload, headers) for /suggest?q=&limit=, shared with the ASGI app
+    try:
+        limit = max(1, min(int(args.get("limit", SUGGEST_LIMIT)), 50))
+    except ValueError:
+        return 400, {"error": "limit must be a number"}, {}
+    q = args.get("q", "")
+    # the index only changes as new regions are geocoded, so browsers may reuse answers briefly
+    return 200, {"q": q, "suggestions": suggester.suggest(q, limit)}, {"Cache-Control": "public, max-age=300"}
+
+@app.route("/suggest")
+def suggest_route():
+    status, payload, headers = suggest_payload(request.args)
+    return jsonify(payload), status, headers
+
 # Route to serve the HTML file
 @app.route("/")
 def index():
-    response = make_response(HTML_CONTENT)
-    response.headers['Content-Type'] = 'text/html'
-    return response
+    status, body, headers = index_response_parts(request.headers.get("Accept-Encoding"),
+                                                 request.headers.get("If-None-Match"))
+    return Response(body, status=status, headers=headers, content_type="text/html; charset=utf-8")
 
-# API endpoint for trip planning
-@app.route("/plan_trip", methods=["POST"])
+# API endpoint for trip planning (GET takes the same fields as query args, for CDN caching)
+@app.route("/plan_trip", methods=["GET", "POST"])
 def plan_trip():
-    d = request.get_json()
-    region, days, mood = d.get("region"), int(d.get("days",3)), d.get("mood","relaxed").lower()
-    lat, lon = geoapify_geocode(region)
-    if not lat: return jsonify({"error":"Could not geocode region"}),400
-    
-    # --- ATTRACTION LOGIC BASED ON MOOD ---
-    if mood == "spiritual":
-        attraction_categories = ["religion.place_of_worship"]
-    else:
-        attraction_categories = ["tourism.attraction","leisure.park"]
-
-    attractions = geoapify_places(lat, lon, attraction_categories) or wikipedia_fallback(region)
-    
-    # --- CALLS THE CORRECTED MOOD_STAYS FUNCTION ---
-    stays = mood_stays(lat, lon, mood)
-
-    restaurants = geoapify_places(lat, lon, ["catering.restaurant"])
-    
-    # Calculate average cost for budget estimation
-    # Use the price from the single default stay, or a safe default
-    avg = 4000 
-    if stays:
-        if not stays[0]["name"].startswith("Default"):
-             avg = int(sum(s["price_inr"] for s in stays)/len(stays))
-        else:
-             avg = stays[0]["price_inr"]
-        
-    cost = estimate_cost(days, avg)
-    
-    return jsonify({
-        "region": region, "coordinates":{"lat":lat,"lon":lon},
-        "mood": mood, "days": days,
-        "stays": stays, 
-        "attractions": attractions,
-        "restaurants": restaurants,
-        "estimated_cost": cost
-    })
+    # malformed or non-JSON bodies get the same JSON 400 as app2_asgi, not Flask's HTML page
+    d = request.args if request.method == "GET" else request.get_json(silent=True)
+    try:
+        if not isinstance(d, dict): raise ValueError("expected a JSON object")
+        region, days, mood = parse_trip_request(d)
+    except (ValueError, TypeError, AttributeError) as e:
+        return jsonify({"error": f"Bad request: {e}"}), 400
+    fmt = stream_format(request.args.get("stream"), request.headers.get("Accept"))
+    if fmt:
+        # streamed plans are replayed from, and stored in, the same plan cache
+        lines = (encode_section(fmt, section, data) for section, data in plan_sections(region, days, mood))
+        return Response(lines, mimetype=STREAM_FORMATS[fmt],
+                        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"})
+    status, body, etag = cached_plan(region, days, mood)
+    if status != 200:
+        return Response(body, status=status, mimetype="application/json")
+    headers = plan_headers(etag)
+    if etag_matches(request.headers.get("If-None-Match"), etag):
+        return Response(status=304, headers=headers)
+    return Response(body, mimetype="application/json", headers=headers)
+
+# Batch endpoint: {"trips": [{"region", "days", "mood"}, ...]} -> one NDJSON line per trip
+@app.route("/plan_trips", methods=["POST"])
+def plan_trips_route():
+    d = request.get_json(silent=True) or {}
+    trips = d.get("trips") if isinstance(d, dict) else None
+    if not isinstance(trips, list) or not trips:
+        return jsonify({"error":"Expected a non-empty 'trips' list"}),400
+    if len(trips) > BATCH_MAX_ITEMS:
+        return jsonify({"error":f"At most {BATCH_MAX_ITEMS} trips per batch"}),400
+
+    def lines():
+        for i, status, payload in plan_trips(trips):
+            yield json_dumps({"index": i, "status": status, "result": payload}) + "\n"
+    return Response(lines(), mimetype="application/x-ndjson")
 
 if __name__ == "__main__":
-    app.run(host="0.0.0.0", port=5050)
\ No newline at end of file
+    app.run(host="0.0.0.0", port=int(os.environ.get("PORT", 5050)))
\ No newline at end of file
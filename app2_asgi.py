@@ -0,0 +1,625 @@
+import asyncio, heapq, os, time
+from functools import partial
+from itertools import count
+from urllib.parse import parse_qsl
+import httpx
+
+from app2 import (
+    index_response_parts, GEOCODE_URL, PLACES_URL, WIKIPEDIA_SEARCH_URL, WIKIPEDIA_HEADERS,
+    HTTP_RETRIES, HTTP_BACKOFF, HTTP_BACKOFF_MAX, HTTP_RETRY_STATUSES, PLAN_BUDGET, PLACES_FETCH_FACTOR,
+    gazetteer, geocode_cache, snapshot, normalize_place, places_cell, nearest_places, memoized_places, stored_places,
+    store_places, shared_cache, shared_name, publish_rows, wait_deadline, SHARED_CLAIM_SECONDS, SHARED_POLL_SECONDS,
+    known_missing, remember_missing, geocode_settled, settled_rows, wikipedia_memo, remember_wikipedia,
+    fallback_start, settle_fallback,
+    geocode_params, parse_geocode, geocode_suggestable, places_params, parse_places, wikipedia_params, parse_wikipedia,
+    stay_options, finish_stays, attraction_categories, plan_categories, RESTAURANT_CATEGORIES,
+    PLACES_CONSOLIDATED, PLACES_UNION_LIMIT, parse_trip_request, build_plan,
+    backoff_delay, breaker_for, hedge_delay, CircuitOpen,
+    PRIORITIES, request_priority, RATE_LIMITS, RATE_LIMIT_BURST, RATE_LIMIT_QUEUE, RATE_LIMIT_MAX_WAIT,
+    TokenBucket, RateLimited, retry_after_seconds, urlsplit,
+    request_deadline, budget_timeout, budget_allows, BudgetExceeded, lookup_failed, geocode_failure,
+    SectionDegraded, degraded,
+    metrics, stage, request_timings, server_timing, metrics_text, stats_payload,
+    plan_cache, plan_cache_key, remember_plan, plan_headers, cached_sections, etag_matches,
+    STREAM_FORMATS, stream_format, encode_section, json_bytes, json_loads, suggest_payload, suggester,
+)
+
+# Async (ASGI) version of app2.py's "/" and "/plan_trip" with the same JSON contract.
+# Upstream I/O never holds a thread, so one process can keep thousands of plans in flight.
+#
+#   uvicorn app2_asgi:app --host 0.0.0.0 --port 5050
+#
+# Set GEOAPIFY_BASE_URL / WIKIPEDIA_BASE_URL to run it against a local stub upstream.
+
+ASYNC_MAX_CONNECTIONS = int(os.environ.get("ASYNC_MAX_CONNECTIONS", 200))
+ASYNC_MAX_KEEPALIVE = int(os.environ.get("ASYNC_MAX_KEEPALIVE", 50))
+
+# ---------------- UPSTREAM HTTP ----------------
+
+class AsyncRateLimiter:
+    # Event-loop counterpart of app2.RateLimiter: same TokenBucket and priority
+    # order, with waiters parked on futures that one dispatcher task releases.
+    def __init__(self, name, rate, burst, max_queue):
+        self.name, self.max_queue = name, max_queue
+        self.bucket = TokenBucket(rate, max(1.0, rate * burst))
+        self.waiters = [] # heap of (priority value, seq, future)
+        self.seq = count()
+        self.dispatcher = None
+        self.counters = {"granted": 0, "queued": 0, "rejected": 0, "throttled": 0}
+        self.waited = self.max_waited = 0.0
+
+    async def acquire(self, priority, max_wait):
+        started = time.monotonic()
+        pending = [w for w in self.waiters if not w[2].done()]
+        if not pending and self.bucket.take(started):
+            return self.granted(priority, 0.0)
+        key = (PRIORITIES[priority], next(self.seq))
+        ahead = sum(1 for w in pending if w[:2] < key)
+        if len(pending) >= self.max_queue or self.bucket.eta(started, ahead) > max_wait:
+            self.reject(priority, "queue full" if len(pending) >= self.max_queue else "wait over budget")
+        fut = asyncio.get_running_loop().create_future()
+        heapq.heappush(self.waiters, key + (fut,))
+        self.counters["queued"] += 1
+        if self.dispatcher is None or self.dispatcher.done():
+            self.dispatcher = asyncio.ensure_future(self.dispatch())
+        try:
+            await asyncio.wait_for(fut, max_wait) # a timed-out future is skipped by dispatch()
+        except asyncio.TimeoutError:
+            self.reject(priority, "wait over budget")
+        return self.granted(priority, time.monotonic() - started)
+
+    async def dispatch(self):
+        while self.waiters:
+            if self.waiters[0][2].done():
+                heapq.heappop(self.waiters)
+                continue
+            now = time.monotonic()
+            if self.bucket.take(now):
+                heapq.heappop(self.waiters)[2].set_result(None)
+            else:
+                await asyncio.sleep(self.bucket.eta(now))
+
+    def granted(self, priority, waited):
+        self.counters["granted"] += 1
+        self.waited += waited
+        self.max_waited = max(self.max_waited, waited)
+        metrics.observe("tripplanner_ratelimit_wait_seconds", waited, host=self.name, priority=priority)
+        return waited
+
+    def reject(self, priority, reason):
+        self.counters["rejected"] += 1
+        metrics.inc("tripplanner_ratelimit_rejected_total", host=self.name, priority=priority, reason=reason)
+        raise RateLimited(f"{self.name} rate limit: {reason}")
+
+    def throttled(self, retry_after):
+        self.counters["throttled"] += 1
+        self.bucket.pause(retry_after, time.monotonic())
+
+    def stats(self):
+        pending = [w for w in self.waiters if not w[2].done()]
+        by_priority = {name: sum(1 for w in pending if w[0] == value) for name, value in PRIORITIES.items()}
+        granted = self.counters["granted"]
+        return dict(self.counters, rate=self.bucket.rate, queue_depth=len(pending), queued_by_priority=by_priority,
+                    avg_wait=round(self.waited / granted, 4) if granted else 0.0, max_wait=round(self.max_waited, 4))
+
+limiters = {} # host -> AsyncRateLimiter; same RATE_LIMITS as the sync app
+
+def limiter_for(url):
+    host = urlsplit(url).netloc
+    if host not in limiters and RATE_LIMITS.get(host):
+        limiters[host] = AsyncRateLimiter(host, RATE_LIMITS[host], RATE_LIMIT_BURST, RATE_LIMIT_QUEUE)
+    return limiters.get(host)
+
+class AsyncUpstreamClient:
+    # Same retry policy as app2.UpstreamClient, on a pooled httpx.AsyncClient
+    def __init__(self, retries, backoff, backoff_max):
+        self.retries, self.backoff, self.backoff_max = retries, backoff, backoff_max
+        self.client = None
+        self.counters = {"requests": 0, "retries": 0, "errors": 0, "hedges": 0, "hedge_wins": 0}
+
+    def start(self):
+        if self.client is None:
+            limits = httpx.Limits(max_connections=ASYNC_MAX_CONNECTIONS, max_keepalive_connections=ASYNC_MAX_KEEPALIVE)
+            self.client = httpx.AsyncClient(limits=limits)
+        return self.client
+
+    async def close(self):
+        if self.client is not None:
+            await self.client.aclose()
+            self.client = None
+
+    async def get(self, url, timeout=None, **kwargs):
+        # same breakers (app2.breakers) as the sync client
+        client = self.start()
+        breaker, limiter = breaker_for(url), limiter_for(url)
+        for attempt in range(self.retries + 1):
+            limit = budget_timeout(timeout)
+            if not breaker.allow():
+                metrics.inc("tripplanner_upstream_errors_total", host=breaker.name, kind="circuit_open")
+                raise CircuitOpen(f"{breaker.name} circuit is open")
+            if limiter is not None:
+                try:
+                    await limiter.acquire(request_priority.get(), budget_timeout(RATE_LIMIT_MAX_WAIT))
+                    limit = budget_timeout(timeout)
+                except BaseException: # RateLimited, BudgetExceeded or cancellation
+                    breaker.release()
+                    metrics.inc("tripplanner_upstream_errors_total", host=breaker.name, kind="rate_limited")
+                    raise
+            self.counters["requests"] += 1
+            metrics.gauge("tripplanner_upstream_in_flight", 1, host=breaker.name)
+            clock = [time.monotonic()] # send moves it to when the answering request was sent
+            try:
+                res = await self.send(client, url, limit, breaker, clock, **kwargs)
+            except (httpx.ConnectError, httpx.ConnectTimeout):
+                breaker.record(False, time.monotonic() - clock[0])
+                self.counters["errors"] += 1
+                metrics.inc("tripplanner_upstream_errors_total", host=breaker.name, kind="connection")
+                delay = backoff_delay(attempt, self.backoff, self.backoff_max)
+                if attempt == self.retries or not budget_allows(delay): raise
+            except httpx.TimeoutException:
+                if limit == timeout: breaker.record(False, time.monotonic() - clock[0])
+                else: breaker.release()
+                metrics.inc("tripplanner_upstream_errors_total", host=breaker.name, kind="timeout")
+                raise
+            except BaseException: # includes cancellation at the plan deadline
+                breaker.release()
+                metrics.inc("tripplanner_upstream_errors_total", host=breaker.name, kind="other")
+                raise
+            else:
+                ok = res.status_code not in HTTP_RETRY_STATUSES
+                breaker.record(ok, time.monotonic() - clock[0])
+                if ok: return res
+                if res.status_code == 429 and limiter is not None: limiter.throttled(retry_after_seconds(res))
+                self.counters["errors"] += 1
+                metrics.inc("tripplanner_upstream_errors_total", host=breaker.name, kind=f"http_{res.status_code}")
+                delay = backoff_delay(attempt, self.backoff, self.backoff_max, res.headers.get("Retry-After"))
+                if attempt == self.retries or not budget_allows(delay): return res
+            finally:
+                metrics.gauge("tripplanner_upstream_in_flight", -1, host=breaker.name)
+                metrics.observe("tripplanner_upstream_request_seconds", time.monotonic() - clock[0], host=breaker.name)
+            self.counters["retries"] += 1
+            metrics.inc("tripplanner_upstream_retries_total", host=breaker.name)
+            await asyncio.sleep(delay)
+
+    async def send(self, client, url, timeout, breaker, clock, **kwargs):
+        # as app2.UpstreamClient.send; the losing request is cancelled
+        delay = hedge_delay(breaker, timeout)
+        if delay is None: return await client.get(url, timeout=timeout, **kwargs)
+        tasks = [asyncio.ensure_future(client.get(url, timeout=timeout, **kwargs))]
+        try:
+            done, _ = await asyncio.wait(tasks, timeout=delay)
+            if done: return tasks[0].result()
+            self.counters["hedges"] += 1
+            metrics.inc("tripplanner_upstream_hedges_total", host=breaker.name)
+            tasks.append(asyncio.ensure_future(client.get(url, timeout=timeout and timeout - delay, **kwargs)))
+            hedged_at = time.monotonic()
+            done, _ = await asyncio.wait(tasks, return_when=asyncio.FIRST_COMPLETED)
+            winner = done.pop()
+            if winner.exception() is not None:
+                winner = tasks[1] if winner is tasks[0] else tasks[0]
+                await asyncio.wait([winner])
+            if winner is tasks[1]:
+                clock[0] = hedged_at
+                self.counters["hedge_wins"] += 1
+                metrics.inc("tripplanner_upstream_hedge_wins_total", host=breaker.name)
+            return winner.result()
+        finally:
+            for task in tasks:
+                if not task.done(): task.cancel()
+                elif not task.cancelled(): task.exception()
+
+upstream = AsyncUpstreamClient(HTTP_RETRIES, HTTP_BACKOFF, HTTP_BACKOFF_MAX)
+
+# ---------------- REQUEST COALESCING ----------------
+
+class AsyncSingleFlight:
+    # Event-loop counterpart of app2.SingleFlight: identical in-flight lookups share one task
+    def __init__(self):
+        self.calls = {}
+        self.counters = {"leaders": 0, "coalesced": 0}
+
+    async def do(self, key, fn, *args):
+        task = self.calls.get(key)
+        if task is None:
+            self.counters["leaders"] += 1
+            task = self.calls[key] = asyncio.ensure_future(fn(*args))
+            task.add_done_callback(lambda _: self.finish(key, task))
+        else:
+            self.counters["coalesced"] += 1
+        # a waiter that times out must not cancel the lookup for everyone else
+        return await asyncio.shield(task)
+
+    def finish(self, key, task):
+        self.calls.pop(key, None)
+        # every waiter may have given up (deadline), so mark the error as seen here
+        if not task.cancelled(): task.exception()
+
+    def stats(self):
+        return dict(self.counters, in_flight=len(self.calls))
+
+inflight = AsyncSingleFlight()
+
+# ---------------- PIPELINE ----------------
+
+async def geoapify_geocode(place):
+    key = normalize_place(place)
+    if not key: return None, None
+    local = (gazetteer.lookup(key) or geocode_cache.warm(key)
+             or await asyncio.to_thread(geocode_cache.cold, key) or snapshot.geocode(key))
+    suggester.planned(key)
+    if local: return local
+    if await asyncio.to_thread(known_missing, "geocode:" + key): return None, None
+    return await inflight.do(("geocode", key), fetch_geocode, key, place)
+
+async def fetch_geocode(key, place):
+    # another worker may be geocoding the same place: wait for its row instead
+    return await host_once("geocode:" + key, partial(geocode_settled, key), partial(refresh_geocode, key, place))
+
+async def refresh_geocode(key, place):
+    try:
+        res = await upstream.get(GEOCODE_URL, params=geocode_params(place), timeout=10)
+        res.raise_for_status()
+        data = res.json()
+        lat, lon = parse_geocode(data)
+    except BudgetExceeded:
+        raise
+    except Exception as e:
+        lookup_failed("Geocode", e) # raises: nothing is remembered
+    # the SQLite writes commit to disk, keep them off the event loop
+    if lat is None:
+        await asyncio.to_thread(remember_missing, "geocode:" + key)
+    else:
+        suggest = geocode_suggestable(data)
+        await asyncio.to_thread(geocode_cache.put, key, lat, lon, suggest)
+        if suggest: suggester.add_region(key)
+    return lat, lon
+
+async def geoapify_places(lat, lon, categories, radius=15000, limit=30):
+    key, (clat, clon), fetch_radius = places_cell(lat, lon, categories, radius, limit)
+    local = memoized_places(key, lat, lon)
+    if local is None: local = await asyncio.to_thread(stored_places, key, lat, lon, categories, radius, limit)
+    if local is not None: return local
+    rows = await inflight.do(("places",) + key, fetch_places, key, clat, clon, categories, fetch_radius, limit)
+    return nearest_places(rows, lat, lon, radius, limit)
+
+async def fetch_places(key, lat, lon, categories, radius, limit):
+    return await host_once(shared_name(key), partial(settled_rows, key), partial(refresh_places, key, lat, lon, categories, radius, limit))
+
+async def refresh_places(key, lat, lon, categories, radius, limit):
+    try:
+        params = places_params(lat, lon, categories, radius, limit * PLACES_FETCH_FACTOR)
+        res = await upstream.get(PLACES_URL, params=params, timeout=15)
+        if res.status_code == 429: raise RateLimited("Geoapify answered 429")
+        res.raise_for_status()
+        rows = parse_places(res.json())
+    except (RateLimited, BudgetExceeded):
+        raise
+    except Exception as e:
+        lookup_failed("Geoapify", e) # raises: neither cached nor remembered as empty
+    store_places(key, rows, lat, lon, categories, radius)
+    await asyncio.to_thread(publish_rows, key, rows, categories)
+    if not rows: await asyncio.to_thread(remember_missing, shared_name(key))
+    return rows
+
+async def host_once(name, lookup, fetch):
+    # app2.host_once with async polling. Every SQLite call runs in a thread: a
+    # read can wait on the lock a writer holds for its busy timeout.
+    if not await asyncio.to_thread(shared_cache.claim, name, SHARED_CLAIM_SECONDS):
+        shared_cache.waits += 1
+        until = wait_deadline()
+        while time.monotonic() < until:
+            found = await asyncio.to_thread(lookup)
+            if found is not None: return found
+            if not await asyncio.to_thread(shared_cache.claimed, name): break
+            await asyncio.sleep(SHARED_POLL_SECONDS)
+        found = await asyncio.to_thread(lookup)
+        return found if found is not None else await fetch()
+    try:
+        return await fetch()
+    finally:
+        await asyncio.to_thread(shared_cache.release, name)
+
+async def wikipedia_fallback(region):
+    memo, pages = await asyncio.to_thread(wikipedia_memo, region)
+    if pages is not None: return pages
+    try:
+        r = await upstream.get(WIKIPEDIA_SEARCH_URL, params=wikipedia_params(region), headers=WIKIPEDIA_HEADERS, timeout=10)
+        r.raise_for_status()
+        pages = parse_wikipedia(r.json(), region)
+    except BudgetExceeded:
+        raise
+    except Exception as e:
+        lookup_failed("Wikipedia", e)
+    await asyncio.to_thread(remember_wikipedia, memo, pages)
+    return pages
+
+async def try_step(failed, coro):
+    # app2.try_step for a coroutine
+    try:
+        return await coro
+    except BudgetExceeded:
+        raise
+    except Exception as e:
+        failed.append(e)
+        return []
+
+async def mood_stays(lat, lon, mood):
+    # app2.mood_stays: the chain starts at the step that last answered in this
+    # cell. Checking and settling that step read the negative cache (SQLite), in a thread.
+    mood = mood.lower().strip()
+    price_range, mood_categories, broad_fallback_category = stay_options(mood)
+    memo, start, tried = await asyncio.to_thread(fallback_start, "stays", lat, lon, mood)
+    stays, step, failed = [], start, []
+    if step == "primary":
+        with stage("stays_primary"):
+            stays = await try_step(failed, geoapify_places(lat, lon, mood_categories))
+        if not stays: step, tried = "broad", tried + [mood_categories]
+    if step == "broad":
+        print(f"DEBUG: No specific '{mood}' stays found. Trying broad accommodation search.")
+        with stage("stays_fallback"):
+            stays = await try_step(failed, geoapify_places(lat, lon, broad_fallback_category))
+        if not stays: step, tried = "default", tried + [broad_fallback_category]
+    if step != start: await asyncio.to_thread(settle_fallback, memo, start, step, lat, lon, tried)
+    return degraded(finish_stays(stays, lat, lon, mood, price_range), failed)
+
+async def mood_attractions(lat, lon, region, mood):
+    categories = attraction_categories(mood)
+    memo, start, _ = await asyncio.to_thread(fallback_start, "attractions", lat, lon, mood)
+    failed = []
+    if start == "primary":
+        found = await try_step(failed, geoapify_places(lat, lon, categories))
+        if found: return found
+        await asyncio.to_thread(settle_fallback, memo, start, "wikipedia", lat, lon, [categories])
+    return degraded(await try_step(failed, wikipedia_fallback(region)), failed)
+
+async def fan_out(calls):
+    # calls: {name: (coroutine, default)} -> ({name: result}, {name: "ok" / "timeout" / "error"})
+    results, status = {}, {}
+    async for name, result, state in fan_out_iter(calls):
+        results[name] = result
+        status[name] = state
+    return results, status
+
+async def fan_out_iter(calls):
+    # Yields (name, result, status) in completion order; unfinished calls get their
+    # default at the request deadline. Tasks inherit request_deadline from the caller.
+    tasks = {asyncio.ensure_future(timed(name, coro)): name for name, (coro, _) in calls.items()}
+    deadline = request_deadline.get()
+    pending = set(tasks)
+    try:
+        while pending:
+            done, pending = await asyncio.wait(pending, timeout=max(0, deadline - time.monotonic()),
+                                               return_when=asyncio.FIRST_COMPLETED)
+            if not done: break
+            for task in done:
+                name = tasks[task]
+                if isinstance(task.exception(), BudgetExceeded):
+                    print(f"⚠️ {name} lookup ran out of budget")
+                    metrics.inc("tripplanner_section_failures_total", section=name, status="timeout")
+                    yield name, calls[name][1], "timeout"
+                elif isinstance(task.exception(), SectionDegraded):
+                    print(f"⚠️ {name} lookup failed, using its fallback:", task.exception())
+                    metrics.inc("tripplanner_section_failures_total", section=name, status="error")
+                    yield name, task.exception().result, "error"
+                elif task.exception() is not None:
+                    print(f"⚠️ {name} lookup failed:", task.exception())
+                    metrics.inc("tripplanner_section_failures_total", section=name, status="error")
+                    yield name, calls[name][1], "error"
+                else:
+                    yield name, task.result(), "ok"
+        for task in pending:
+            print(f"⚠️ {tasks[task]} lookup ran out of budget")
+            metrics.inc("tripplanner_section_failures_total", section=tasks[task], status="timeout")
+            yield tasks[task], calls[tasks[task]][1], "timeout"
+    finally:
+        for task in pending: task.cancel()
+
+async def timed(name, coro):
+    with stage(name): return await coro
+
+def plan_calls(lat, lon, region, mood):
+    calls = {
+        "attractions": (mood_attractions(lat, lon, region, mood), []),
+        "stays": (mood_stays(lat, lon, mood), []),
+        "restaurants": (geoapify_places(lat, lon, RESTAURANT_CATEGORIES), []),
+    }
+    if PLACES_CONSOLIDATED:
+        calls = {name: (after_prefetch(lat, lon, mood, coro), default) for name, (coro, default) in calls.items()}
+    return calls
+
+async def after_prefetch(lat, lon, mood, coro):
+    await prefetch_places(lat, lon, mood)
+    return await coro
+
+async def prefetch_places(lat, lon, mood):
+    # see app2.prefetch_places
+    try:
+        with stage("places_union"):
+            await geoapify_places(lat, lon, plan_categories(mood), limit=PLACES_UNION_LIMIT)
+    except Exception as e:
+        print("⚠️ Consolidated places fetch failed:", e)
+
+async def plan_one(region, days, mood):
+    # runs as its own task (one per ASGI request), so the deadline stays with this plan
+    deadline = time.monotonic() + PLAN_BUDGET
+    request_deadline.set(deadline)
+    try:
+        with stage("geocode"):
+            lat, lon = await geoapify_geocode(region)
+    except Exception as e:
+        return (*geocode_failure(deadline, e), False)
+    if not lat: return (*geocode_failure(deadline), False)
+    found, status = await fan_out(plan_calls(lat, lon, region, mood))
+    sections = dict(coordinates="ok", **status)
+    payload = build_plan(region, days, mood, lat, lon,
+                         found["stays"], found["attractions"], found["restaurants"], sections)
+    return 200, payload, not payload["partial"]
+
+async def plan_sections(region, days, mood):
+    # async counterpart of app2.plan_sections, sharing its plan cache
+    key = plan_cache_key(region, days, mood)
+    hit = plan_cache.get(key)
+    if hit is not None:
+        for section, data in cached_sections(hit[0]): yield section, data
+        return
+    deadline = time.monotonic() + PLAN_BUDGET
+    request_deadline.set(deadline)
+    yield "plan", {"region": region, "mood": mood, "days": days}
+    try:
+        with stage("geocode"):
+            lat, lon = await geoapify_geocode(region)
+    except Exception as e:
+        yield "error", geocode_failure(deadline, e)[1]
+        return
+    if not lat:
+        yield "error", geocode_failure(deadline)[1]
+        return
+    yield "coordinates", {"lat": lat, "lon": lon}
+    found, sections = {}, {"coordinates": "ok"}
+    async for name, result, state in fan_out_iter(plan_calls(lat, lon, region, mood)):
+        found[name], sections[name] = result, state
+        yield name, result
+    plan = build_plan(region, days, mood, lat, lon, found["stays"], found["attractions"], found["restaurants"], sections)
+    yield "estimated_cost", plan["estimated_cost"]
+    yield "itinerary", plan["itinerary"]
+    remember_plan(key, 200, plan, not plan["partial"])
+    yield "done", {"partial": plan["partial"], "sections": sections}
+
+async def cached_plan(region, days, mood):
+    # same response cache and ETags as app2.cached_plan
+    key = plan_cache_key(region, days, mood)
+    hit = plan_cache.get(key)
+    if hit is not None: return (200,) + hit
+    status, payload, complete = await plan_one(region, days, mood)
+    return (status,) + remember_plan(key, status, payload, complete)
+
+# ---------------- ASGI APP ----------------
+
+async def read_body(receive):
+    body = b""
+    while True:
+        message = await receive()
+        body += message.get("body", b"")
+        if not message.get("more_body"): return body
+
+async def read_json(receive):
+    # None for a malformed body, like Flask's get_json(silent=True)
+    try:
+        return json_loads(await read_body(receive))
+    except ValueError:
+        return None
+
+def request_header(scope, name):
+    for k, v in scope.get("headers", ()):
+        if k.lower() == name: return v.decode("latin-1")
+    return None
+
+async def respond(send, status, body, content_type, headers=()):
+    await send({"type": "http.response.start", "status": status,
+                "headers": [(b"content-type", content_type.encode()), (b"content-length", str(len(body)).encode()), *headers]})
+    await send({"type": "http.response.body", "body": body})
+
+async def respond_stream(send, content_type, chunks):
+    await send({"type": "http.response.start", "status": 200,
+                "headers": [(b"content-type", content_type.encode()), (b"cache-control", b"no-cache"), (b"x-accel-buffering", b"no")]})
+    async for chunk in chunks:
+        await send({"type": "http.response.body", "body": chunk.encode(), "more_body": True})
+    await send({"type": "http.response.body", "body": b""})
+
+async def respond_json(send, status, payload):
+    await respond(send, status, json_bytes(payload), "application/json")
+
+async def lifespan(receive, send):
+    while True:
+        message = await receive()
+        if message["type"] == "lifespan.startup":
+            upstream.start()
+            await send({"type": "lifespan.startup.complete"})
+        elif message["type"] == "lifespan.shutdown":
+            await upstream.close()
+            await send({"type": "lifespan.shutdown.complete"})
+            return
+
+ROUTES = ("/", "/plan_trip", "/suggest", "/stats", "/metrics")
+
+async def app(scope, receive, send):
+    if scope["type"] == "lifespan": return await lifespan(receive, send)
+    if scope["type"] != "http": return
+    # Per-request latency metrics and the Server-Timing header. Every ASGI request
+    # runs in its own task, so request_timings stays with this request.
+    started = time.perf_counter()
+    timings = []
+    request_timings.set(timings)
+    status = [500]
+
+    async def timed_send(message):
+        if message["type"] == "http.response.start":
+            status[0] = message["status"]
+            headers = list(message.get("headers", ()))
+            # streamed bodies are produced after the headers go out
+            if any(k == b"content-length" for k, _ in headers):
+                headers.append((b"server-timing", server_timing(timings, time.perf_counter() - started).encode()))
+            message = dict(message, headers=headers)
+        await send(message)
+
+    metrics.gauge("tripplanner_http_in_flight", 1)
+    try:
+        await route(scope, receive, timed_send)
+    finally:
+        metrics.gauge("tripplanner_http_in_flight", -1)
+        path = scope["path"] if scope["path"] in ROUTES else "unmatched"
+        metrics.observe("tripplanner_http_request_seconds", time.perf_counter() - started, route=path, method=scope["method"])
+        metrics.inc("tripplanner_http_responses_total", route=path, status=status[0])
+
+async def route(scope, receive, send):
+    path, method = scope["path"], scope["method"]
+
+    if path == "/" and method in ("GET", "HEAD"):
+        status, body, headers = index_response_parts(request_header(scope, b"accept-encoding"),
+                                                     request_header(scope, b"if-none-match"))
+        headers = [(k.lower().encode(), v.encode()) for k, v in headers.items()]
+        return await respond(send, status, body, "text/html; charset=utf-8", headers)
+
+    if path == "/plan_trip" and method in ("GET", "POST"):
+        try:
+            if method == "GET":
+                d = dict(parse_qsl(scope.get("query_string", b"").decode()))
+            else:
+                d = await read_json(receive)
+            if not isinstance(d, dict): raise ValueError("expected a JSON object")
+            region, days, mood = parse_trip_request(d)
+        except (ValueError, TypeError, AttributeError) as e:
+            return await respond_json(send, 400, {"error": f"Bad request: {e}"})
+        query = dict(parse_qsl(scope.get("query_string", b"").decode()))
+        fmt = stream_format(query.get("stream"), request_header(scope, b"accept"))
+        if fmt:
+            return await respond_stream(send, STREAM_FORMATS[fmt],
+                                        (encode_section(fmt, section, data) async for section, data in plan_sections(region, days, mood)))
+        status, body, etag = await cached_plan(region, days, mood)
+        if status != 200:
+            return await respond(send, status, body, "application/json")
+        headers = [(k.lower().encode(), v.encode()) for k, v in plan_headers(etag).items()]
+        if etag_matches(request_header(scope, b"if-none-match"), etag):
+            return await respond(send, 304, b"", "application/json", headers)
+        return await respond(send, 200, body, "application/json", headers)
+
+    if path == "/suggest" and method == "GET":
+        status, payload, headers = suggest_payload(dict(parse_qsl(scope.get("query_string", b"").decode())))
+        return await respond(send, status, json_bytes(payload), "application/json",
+                             [(k.lower().encode(), v.encode()) for k, v in headers.items()])
+
+    if path == "/stats" and method == "GET":
+        # stats_payload counts shared cache rows in SQLite, so it runs in a thread
+        return await respond_json(send, 200, dict(await asyncio.to_thread(stats_payload), async_http=upstream.counters, async_singleflight=inflight.stats(),
+                                                async_rate_limits={host: l.stats() for host, l in limiters.items()}))
+
+    if path == "/metrics" and method == "GET":
+        series = [("tripplanner_singleflight_in_flight", "gauge", {"app": "async"}, inflight.stats()["in_flight"])]
+        series += [("tripplanner_ratelimit_queue_depth", "gauge", {"host": host, "priority": p, "app": "async"}, n)
+                   for host, l in limiters.items() for p, n in l.stats()["queued_by_priority"].items()]
+        text = await asyncio.to_thread(metrics_text, series)
+        return await respond(send, 200, text.encode(), "text/plain; version=0.0.4")
+
+    if path in ROUTES:
+        return await respond_json(send, 405, {"error": "Method not allowed"})
+    return await respond_json(send, 404, {"error": "Not found"})
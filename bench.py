@@ -0,0 +1,231 @@
+import argparse, gc, json, math, os, platform, subprocess, sys, tempfile, threading, time, tracemalloc, uuid
+from itertools import count
+import requests
+
+from bench_stub import serve, add_stub_args, stub_config, places_response
+
+# Load generator for app2.py (Flask) and app2_asgi.py against the local stub
+# upstream in bench_stub.py. Drives /plan_trip and / at each concurrency level,
+# reports throughput and p50/p95/p99, and saves a JSON result file that later
+# runs can be compared against.
+#
+#   python bench.py --spawn flask --label before
+#   python bench.py --spawn flask --label after --compare bench_results/before.json
+#   python bench.py --url http://127.0.0.1:5050 --endpoints plan_trip --mix cold
+#   python bench.py --poi-memory 20000
+#
+# --mix picks the /plan_trip traffic: hot repeats a few trips (response cache),
+# warm varies days over known regions (geocode/places caches), cold sends a new
+# region every request (every lookup goes upstream).
+#
+# --poi-memory N measures what the places caches retain per place: N stub
+# places parsed into app2's POIs versus the dict rows they replaced.
+
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+RESULTS_DIR = os.path.join(BASE_DIR, "bench_results")
+
+HOT_REGIONS = ["Jaipur", "Goa", "Manali", "Varanasi", "Udaipur", "Rishikesh", "Munnar", "Agra"]
+MOODS = ["relaxed", "adventurous", "cultural", "spiritual"]
+BROWSER_HEADERS = {"Accept-Encoding": "gzip, deflate, br"}
+
+def percentile(ordered, p):
+    if not ordered: return None
+    return ordered[max(0, math.ceil(p / 100 * len(ordered)) - 1)]
+
+def plan_request(mix, i, run_id):
+    if mix == "hot":
+        return {"region": HOT_REGIONS[i % len(HOT_REGIONS)], "days": 3, "mood": MOODS[i // len(HOT_REGIONS) % len(MOODS)]}
+    if mix == "warm":
+        return {"region": HOT_REGIONS[i % len(HOT_REGIONS)], "days": 1 + i % 30, "mood": MOODS[i % len(MOODS)]}
+    return {"region": f"Benchpur {run_id} {i}", "days": 1 + i % 14, "mood": MOODS[i % len(MOODS)]}
+
+def run_level(base_url, endpoint, mix, concurrency, duration, run_id):
+    # Closed loop: each worker sends its next request when the last one returns
+    seq = count()
+    latencies, errors = [], [0]
+    lock = threading.Lock()
+    stop_at = time.perf_counter() + duration
+
+    def worker():
+        session = requests.Session()
+        mine, failed = [], 0
+        while time.perf_counter() < stop_at:
+            i = next(seq)
+            started = time.perf_counter()
+            try:
+                if endpoint == "index":
+                    res = session.get(f"{base_url}/", headers=BROWSER_HEADERS, timeout=30)
+                else:
+                    res = session.post(f"{base_url}/plan_trip", json=plan_request(mix, i, run_id), timeout=60)
+                ok = res.status_code in (200, 304)
+            except requests.RequestException:
+                ok = False
+            mine.append(time.perf_counter() - started)
+            failed += not ok
+        with lock:
+            latencies.extend(mine)
+            errors[0] += failed
+
+    started = time.perf_counter()
+    threads = [threading.Thread(target=worker) for _ in range(concurrency)]
+    for t in threads: t.start()
+    for t in threads: t.join()
+    elapsed = time.perf_counter() - started
+
+    ordered = sorted(latencies)
+    ms = lambda v: round(v * 1000, 2) if v is not None else None
+    return {
+        "endpoint": endpoint, "mix": mix if endpoint == "plan_trip" else None, "concurrency": concurrency,
+        "requests": len(ordered), "errors": errors[0],
+        "error_rate": round(errors[0] / len(ordered), 4) if ordered else 0.0,
+        "duration_s": round(elapsed, 2),
+        "throughput_rps": round(len(ordered) / elapsed, 2) if elapsed else 0.0,
+        "latency_ms": {"mean": ms(sum(ordered) / len(ordered)) if ordered else None,
+                       "p50": ms(percentile(ordered, 50)), "p95": ms(percentile(ordered, 95)),
+                       "p99": ms(percentile(ordered, 99)), "max": ms(ordered[-1] if ordered else None)},
+    }
+
+def spawn_app(kind, port, upstream, workdir):
+    # every cache file lives in the run's own workdir, so a run never starts warm
+    env = dict(os.environ, GEOAPIFY_BASE_URL=upstream, WIKIPEDIA_BASE_URL=upstream, PORT=str(port),
+               GEOCODE_DB=os.path.join(workdir, "geocode_cache.sqlite3"), SHARED_CACHE_DB=os.path.join(workdir, "shared_cache.sqlite3"),
+               SNAPSHOT_PATH=os.path.join(workdir, "cache_snapshot.bin"))
+    if kind == "flask":
+        cmd = [sys.executable, os.path.join(BASE_DIR, "app2.py")]
+    else:
+        cmd = [sys.executable, "-m", "uvicorn", "app2_asgi:app", "--port", str(port), "--log-level", "warning"]
+    proc = subprocess.Popen(cmd, cwd=BASE_DIR, env=env, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    base_url = f"http://127.0.0.1:{port}"
+    for _ in range(150):
+        if proc.poll() is not None: sys.exit(f"❌ {kind} app exited with status {proc.returncode}")
+        try:
+            requests.get(f"{base_url}/stats", timeout=1)
+            return proc, base_url
+        except requests.RequestException:
+            time.sleep(0.1)
+    proc.terminate()
+    sys.exit(f"❌ {kind} app did not start on port {port}")
+
+def git_commit():
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], cwd=BASE_DIR, capture_output=True,
+                              text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+def compare(results, baseline_path):
+    with open(baseline_path, encoding="utf-8") as f:
+        baseline = {(r["endpoint"], r["mix"], r["concurrency"]): r for r in json.load(f)["results"]}
+    print(f"\n📊 Compared with {baseline_path} (change vs baseline)")
+    print(f"{'scenario':<28}{'rps':>16}{'p50 ms':>18}{'p95 ms':>18}{'p99 ms':>18}")
+    for r in results:
+        key = (r["endpoint"], r["mix"], r["concurrency"])
+        old = baseline.get(key)
+        name = f"{r['endpoint']}/{r['mix'] or '-'} c={r['concurrency']}"
+        if old is None:
+            print(f"{name:<28}  (not in baseline)")
+            continue
+        cells = [delta(r["throughput_rps"], old["throughput_rps"])]
+        cells += [delta(r["latency_ms"][p], old["latency_ms"][p]) for p in ("p50", "p95", "p99")]
+        print(f"{name:<28}" + "".join(f"{c:>18}" if i else f"{c:>16}" for i, c in enumerate(cells)))
+
+def delta(new, old):
+    if new is None or not old: return f"{new}"
+    return f"{new} ({(new - old) / old * 100:+.1f}%)"
+
+def legacy_rows(data):
+    # the cache rows places were kept as before POI: (lat, lon, place dict with its map_url, categories)
+    out = []
+    for f in data["features"]:
+        p = f["properties"]
+        map_url = f"https://www.google.com/maps/search/?api=1&query={p['lat']},{p['lon']}"
+        out.append((float(p["lat"]), float(p["lon"]), {"name": p["name"], "address": p.get("formatted", ""), "map_url": map_url,
+                    "lat": float(p["lat"]), "lon": float(p["lon"])}, tuple(p.get("categories", ()))))
+    return out
+
+def retained_bytes(bodies, parse):
+    # bytes still allocated once the parsed responses are dropped and only the rows remain
+    gc.collect()
+    tracemalloc.start()
+    rows = [parse(json.loads(body)) for body in bodies]
+    gc.collect()
+    size = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+    return size, sum(map(len, rows))
+
+def poi_memory(n):
+    import app2 # only this mode needs the app itself
+    bodies = [json.dumps(places_response({"filter": f"circle:{73 + i * 0.05},{18 + i * 0.05},15000", "limit": "100",
+                                          "categories": "accommodation,catering,tourism"}, False)) for i in range(math.ceil(n / 100))]
+    old, count = retained_bytes(bodies, legacy_rows)
+    new, _ = retained_bytes(bodies, app2.parse_places)
+    print(f"🧮 {count} places: dict rows {old / count:.0f} B/place, POI {new / count:.0f} B/place "
+          f"({(old - new) / old * 100:.0f}% less)")
+
+def main():
+    parser = argparse.ArgumentParser(description="Throughput/latency benchmark for the trip planner")
+    parser.add_argument("--url", help="benchmark an app that is already running (point it at bench_stub.py yourself)")
+    parser.add_argument("--spawn", choices=["flask", "asgi"], default="flask", help="app to start when --url is not given")
+    parser.add_argument("--port", type=int, default=5099, help="port for the spawned app")
+    parser.add_argument("--stub-port", type=int, default=0, help="port for the in-process stub upstream (0 = any free port)")
+    parser.add_argument("--endpoints", default="plan_trip,index")
+    parser.add_argument("--mix", default="warm", help="comma-separated /plan_trip mixes: hot, warm, cold")
+    parser.add_argument("--concurrency", default="1,8,32")
+    parser.add_argument("--duration", type=float, default=10, help="seconds per scenario")
+    parser.add_argument("--label", default=None)
+    parser.add_argument("--out", default=None, help=f"result file (default {RESULTS_DIR}/<label>.json)")
+    parser.add_argument("--compare", default=None, help="earlier result file to diff against")
+    parser.add_argument("--poi-memory", type=int, default=0, metavar="N", help="measure cached bytes per place over N places and exit")
+    add_stub_args(parser)
+    args = parser.parse_args()
+    if args.poi_memory: return poi_memory(args.poi_memory)
+
+    run_id = uuid.uuid4().hex[:8]
+    commit = git_commit()
+    label = args.label or time.strftime("%Y%m%d-%H%M%S") + (f"-{commit}" if commit else "")
+    stub, proc, workdir, config = None, None, None, stub_config(args)
+    if args.url:
+        base_url = args.url.rstrip("/")
+    else:
+        # the spawned app's cache files, removed once it has exited
+        workdir = tempfile.TemporaryDirectory(prefix="bench-")
+        stub = serve("127.0.0.1", args.stub_port, config)
+        proc, base_url = spawn_app(args.spawn, args.port, f"http://127.0.0.1:{stub.server_port}", workdir.name)
+        print(f"🚀 {args.spawn} app on {base_url}, stub upstream on port {stub.server_port}")
+
+    results = []
+    try:
+        for endpoint in args.endpoints.split(","):
+            for mix in (args.mix.split(",") if endpoint == "plan_trip" else [None]):
+                for concurrency in (int(c) for c in args.concurrency.split(",")):
+                    r = run_level(base_url, endpoint, mix, concurrency, args.duration, run_id)
+                    lat = r["latency_ms"]
+                    print(f"{endpoint}/{mix or '-'} c={concurrency}: {r['throughput_rps']} req/s, "
+                          f"p50 {lat['p50']} ms, p95 {lat['p95']} ms, p99 {lat['p99']} ms, errors {r['errors']}/{r['requests']}")
+                    results.append(r)
+        server_stats = requests.get(f"{base_url}/stats", timeout=5).json()
+    finally:
+        if proc is not None:
+            proc.terminate()
+            proc.wait()
+        if stub is not None: stub.shutdown()
+        if workdir is not None: workdir.cleanup()
+
+    report = {
+        "label": label, "created": time.strftime("%Y-%m-%dT%H:%M:%S%z"), "git_commit": commit,
+        "python": platform.python_version(), "platform": platform.platform(),
+        "target": args.url or args.spawn,
+        "settings": {k: v for k, v in vars(args).items() if k not in ("url", "out", "compare", "label")},
+        "stub": dict(config.counters) if stub else None,
+        "server_stats": server_stats,
+        "results": results,
+    }
+    out = args.out or os.path.join(RESULTS_DIR, f"{label}.json")
+    os.makedirs(os.path.dirname(os.path.abspath(out)), exist_ok=True)
+    with open(out, "w", encoding="utf-8") as f:
+        json.dump(report, f, indent=2)
+    print(f"💾 Saved {out}")
+    if args.compare: compare(results, args.compare)
+
+if __name__ == "__main__":
+    main()
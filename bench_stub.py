@@ -0,0 +1,152 @@
+import argparse, hashlib, json, random, threading, time
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+from urllib.parse import urlsplit, parse_qsl
+
+# Local stand-in for Geoapify and Wikipedia, so app2.py can be load-tested
+# without spending API quota. Responses have the same shape as the real APIs and
+# are deterministic per query; latency and failures are injected per request.
+#
+#   python bench_stub.py --port 18080 --latency 80 --jitter 40 --error-rate 0.02
+#   GEOAPIFY_BASE_URL=http://127.0.0.1:18080 WIKIPEDIA_BASE_URL=http://127.0.0.1:18080 python app2.py
+#
+# GET /__stats returns request and injected-fault counters.
+
+GEOCODE_PATH = "/v1/geocode/search"
+PLACES_PATH = "/v2/places"
+WIKIPEDIA_PATH = "/w/rest.php/v1/search/title"
+
+NAMES = ["Fort", "Palace", "Garden", "Temple", "Market", "Lake View", "Heritage", "Bazaar", "Ghat", "Museum",
+         "Haveli", "Retreat", "Residency", "Point", "Cafe", "Dhaba", "Courtyard", "Gateway", "Springs", "Hill"]
+
+class StubConfig:
+    def __init__(self, latency=50, jitter=20, error_rate=0.0, slow_rate=0.0, slow_latency=3000, empty_rate=0.0, seed=None):
+        self.latency, self.jitter = latency / 1000, jitter / 1000
+        self.error_rate, self.slow_rate, self.slow_latency = error_rate, slow_rate, slow_latency / 1000
+        self.empty_rate = empty_rate
+        self.random = random.Random(seed)
+        self.lock = threading.Lock()
+        self.counters = {"requests": 0, "errors": 0, "slow": 0, "empty": 0}
+
+    def fault(self):
+        # -> (delay seconds, "error" / "empty" / None) for one request
+        with self.lock:
+            self.counters["requests"] += 1
+            roll = self.random.random()
+            delay = max(0.0, self.random.gauss(self.latency, self.jitter))
+            if self.random.random() < self.slow_rate:
+                self.counters["slow"] += 1
+                delay = self.slow_latency
+            if roll < self.error_rate:
+                self.counters["errors"] += 1
+                return delay, "error"
+            if roll < self.error_rate + self.empty_rate:
+                self.counters["empty"] += 1
+                return delay, "empty"
+            return delay, None
+
+# A query for a parent category returns features from its subcategories, as Geoapify does
+SUBCATEGORIES = {
+    "accommodation": ["accommodation.hotel", "accommodation.resort", "accommodation.hostel", "accommodation.guest_house",
+                      "accommodation.home_stay", "accommodation.apartment", "accommodation.lodge"],
+    "catering": ["catering.restaurant", "catering.cafe", "catering.fast_food"],
+    "tourism": ["tourism.attraction", "tourism.sights"],
+}
+
+def seeded(*parts):
+    return random.Random(hashlib.blake2b(repr(parts).encode(), digest_size=8).digest())
+
+def geocode_response(q, empty):
+    if empty: return {"results": []}
+    r = seeded("geocode", q.get("text", "").lower())
+    return {"results": [{"lat": round(r.uniform(8, 34), 6), "lon": round(r.uniform(69, 92), 6),
+                         "formatted": q.get("text", "")}]}
+
+def places_response(q, empty):
+    if empty: return {"type": "FeatureCollection", "features": []}
+    lon, lat, radius = (float(v) for v in q["filter"].split(":", 1)[1].split(","))
+    categories = q.get("categories", "tourism.sights").split(",")
+    limit = int(q.get("limit", 20))
+    r = seeded("places", round(lat, 3), round(lon, 3), q.get("categories"))
+    spread = radius / 111320 # metres -> degrees, roughly
+    features = []
+    for i in range(limit):
+        category = categories[i % len(categories)]
+        if category in SUBCATEGORIES: category = r.choice(SUBCATEGORIES[category])
+        plat, plon = lat + r.uniform(-spread, spread) * 0.7, lon + r.uniform(-spread, spread) * 0.7
+        name = f"{r.choice(NAMES)} {r.choice(NAMES)} {i}"
+        features.append({"type": "Feature",
+                         "properties": {"name": name, "lat": plat, "lon": plon, "formatted": f"{name}, Stub Road",
+                                        "categories": [category.split(".")[0], category]},
+                         "geometry": {"type": "Point", "coordinates": [plon, plat]}})
+    return {"type": "FeatureCollection", "features": features}
+
+def wikipedia_response(q, empty):
+    if empty: return {"pages": []}
+    r = seeded("wikipedia", q.get("q", ""))
+    limit = int(q.get("limit", 10))
+    return {"pages": [{"id": i, "key": f"Page_{i}", "title": f"{r.choice(NAMES)} {i}"} for i in range(limit)]}
+
+ROUTES = {GEOCODE_PATH: geocode_response, PLACES_PATH: places_response, WIKIPEDIA_PATH: wikipedia_response}
+
+def make_handler(config):
+    class Handler(BaseHTTPRequestHandler):
+        protocol_version = "HTTP/1.1" # keep-alive, like the real upstreams
+
+        def log_message(self, *args):
+            pass
+
+        def do_GET(self):
+            parts = urlsplit(self.path)
+            if parts.path == "/__stats":
+                with config.lock: return self.send_json(200, dict(config.counters))
+            build = ROUTES.get(parts.path)
+            if build is None: return self.send_json(404, {"error": "not found"})
+            delay, fault = config.fault()
+            time.sleep(delay)
+            if fault == "error": return self.send_json(503, {"error": "injected failure"})
+            try:
+                return self.send_json(200, build(dict(parse_qsl(parts.query)), fault == "empty"))
+            except (KeyError, ValueError) as e:
+                return self.send_json(400, {"error": f"bad query: {e}"})
+
+        def send_json(self, status, payload):
+            body = json.dumps(payload).encode()
+            self.send_response(status)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+    return Handler
+
+def serve(host, port, config):
+    # -> a started server (serve_forever on a daemon thread); server.server_port has the bound port
+    server = ThreadingHTTPServer((host, port), make_handler(config))
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+def add_stub_args(parser):
+    parser.add_argument("--latency", type=float, default=50, help="mean upstream latency, ms")
+    parser.add_argument("--jitter", type=float, default=20, help="latency standard deviation, ms")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="fraction of requests answered 503")
+    parser.add_argument("--slow-rate", type=float, default=0.0, help="fraction of requests delayed by --slow-latency")
+    parser.add_argument("--slow-latency", type=float, default=3000, help="ms")
+    parser.add_argument("--empty-rate", type=float, default=0.0, help="fraction of requests with no results")
+    parser.add_argument("--seed", type=int, default=None)
+
+def stub_config(args):
+    return StubConfig(args.latency, args.jitter, args.error_rate, args.slow_rate, args.slow_latency, args.empty_rate, args.seed)
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Local Geoapify/Wikipedia stub for benchmarks")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=18080)
+    add_stub_args(parser)
+    args = parser.parse_args()
+    server = ThreadingHTTPServer((args.host, args.port), make_handler(stub_config(args)))
+    server.daemon_threads = True
+    print(f"🧪 Stub upstream on http://{args.host}:{args.port}")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
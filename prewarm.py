@@ -0,0 +1,57 @@
+import argparse, os, sys, time
+
+import app2
+
+# Prewarms the geocode and places caches for the most visited destinations under
+# every mood, then saves them to the snapshot file app2.py maps in at startup
+# (SNAPSHOT_PATH), so a fresh process serves those plans without the network.
+#
+#   python prewarm.py --top 50
+#   python prewarm.py --destinations destinations.txt --out /srv/tripplanner/cache_snapshot.bin
+#
+# Destinations default to the gazetteer's most popular entries. A --destinations
+# file has one place per line; blank lines and # comments are skipped. An existing
+# snapshot at the output path is loaded first, so entries that are still fresh
+# are carried over instead of fetched again. Upstream calls run at "prewarm" priority.
+
+MOODS = ["relaxed", "adventurous", "cultural", "spiritual"]
+
+def top_destinations(n):
+    ranked = sorted(app2.gazetteer.places, key=lambda p: -p["popularity"])
+    return [p["name"] for p in ranked[:n]]
+
+def read_destinations(path):
+    with open(path, encoding="utf-8") as f:
+        return [line.strip() for line in f if line.strip() and not line.lstrip().startswith("#")]
+
+def main():
+    parser = argparse.ArgumentParser(description="Prewarm caches and write a startup snapshot")
+    parser.add_argument("--destinations", help="file of destinations, one per line")
+    parser.add_argument("--top", type=int, default=50, help="gazetteer destinations to prewarm when no file is given")
+    parser.add_argument("--moods", default=",".join(MOODS))
+    parser.add_argument("--workers", type=int, default=app2.BATCH_WORKERS)
+    parser.add_argument("--out", default=app2.SNAPSHOT_PATH)
+    args = parser.parse_args()
+
+    if os.path.abspath(args.out) != os.path.abspath(app2.SNAPSHOT_PATH):
+        app2.snapshot = app2.Snapshot(args.out)
+    regions = read_destinations(args.destinations) if args.destinations else top_destinations(args.top)
+    trips = [(region, 3, mood) for region in regions for mood in args.moods.split(",")] # places don't depend on days
+    print(f"🔥 Prewarming {len(regions)} destinations x {len(trips) // max(1, len(regions))} moods")
+
+    started = time.perf_counter()
+    done = {"ok": 0, "partial": 0, "failed": 0}
+    for i, status, payload in app2.plan_trips(trips, args.workers, priority="prewarm"):
+        outcome = "failed" if status != 200 else "partial" if payload.get("partial") else "ok"
+        done[outcome] += 1
+        if outcome != "ok": print(f"⚠️ {trips[i][0]} / {trips[i][2]}: {outcome} ({status})")
+    print(f"✅ Planned {len(trips)} trips in {time.perf_counter() - started:.1f}s: {done}")
+
+    if app2.places_cache.stats()["evictions"]:
+        print("⚠️ Places cache evicted entries during the run; raise PLACES_CACHE_ENTRIES / PLACES_CACHE_MAX_POIS")
+    written = app2.write_snapshot(args.out)
+    print(f"💾 Wrote {args.out}: {written['geocodes']} geocodes, {written['places']} place fetches, {written['bytes']} bytes")
+    return 1 if done["failed"] == len(trips) else 0
+
+if __name__ == "__main__":
+    sys.exit(main())
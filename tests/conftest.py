@@ -0,0 +1,65 @@
+import asyncio, os, sys, tempfile
+import pytest
+
+# app2 reads its configuration at import, so the stub upstream and a scratch
+# directory are set up before any test module imports it
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from bench_stub import serve, StubConfig
+
+STUB = StubConfig(latency=1, jitter=0, seed=1)
+stub_server = serve("127.0.0.1", 0, STUB)
+workdir = tempfile.TemporaryDirectory(prefix="tripplanner-tests-")
+STUB_URL = f"http://127.0.0.1:{stub_server.server_port}"
+os.environ.update(
+    GEOAPIFY_BASE_URL=STUB_URL, WIKIPEDIA_BASE_URL=STUB_URL,
+    GEOCODE_DB=os.path.join(workdir.name, "geocode_cache.sqlite3"),
+    SHARED_CACHE_DB=os.path.join(workdir.name, "shared_cache.sqlite3"),
+    SNAPSHOT_PATH=os.path.join(workdir.name, "cache_snapshot.bin"),
+    HTTP_RETRIES="0", BREAKER_MIN_CALLS="1000", # injected failures must not open the breakers
+)
+
+def pytest_unconfigure(config):
+    stub_server.shutdown()
+    workdir.cleanup()
+
+@pytest.fixture
+def stub():
+    # the shared stub; faults and latency a test injects are reset afterwards
+    latency = STUB.latency
+    yield STUB
+    STUB.error_rate = STUB.empty_rate = 0.0
+    STUB.latency = latency
+
+class FlaskClient:
+    def __init__(self):
+        import app2
+        self.client = app2.app.test_client()
+
+    def request(self, method, path, params=None, json=None, content=None, headers=None):
+        r = self.client.open(path, method=method, query_string=params, json=json, data=content, headers=headers)
+        return r.status_code, {k.lower(): v for k, v in r.headers.items()}, r.get_data()
+
+class ASGIClient:
+    # one event loop for the session: the app's httpx client and limiters belong to it
+    loop = None
+
+    def __init__(self):
+        import app2_asgi, httpx
+        if ASGIClient.loop is None: ASGIClient.loop = asyncio.new_event_loop()
+        self.client = httpx.AsyncClient(transport=httpx.ASGITransport(app=app2_asgi.app), base_url="http://test")
+
+    def request(self, method, path, params=None, json=None, content=None, headers=None):
+        r = self.loop.run_until_complete(self.client.request(method, path, params=params, json=json, content=content, headers=headers))
+        return r.status_code, dict(r.headers), r.content
+
+APPS = {"flask": FlaskClient, "asgi": ASGIClient}
+
+@pytest.fixture(params=sorted(APPS))
+def client(request):
+    return APPS[request.param]()
+
+@pytest.fixture
+def both():
+    return {name: make() for name, make in APPS.items()}
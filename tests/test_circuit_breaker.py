@@ -0,0 +1,74 @@
+import time
+from app2 import CircuitBreaker
+
+def breaker(open_for=0.05):
+    # opens when more than half of the last (at least 4) calls failed or took over 1 s
+    return CircuitBreaker("test", window=10, min_calls=4, failure_ratio=0.5, slow_call=1.0, open_for=open_for)
+
+def fail(b, n):
+    for _ in range(n):
+        assert b.allow()
+        b.record(False, 0.01)
+
+def test_stays_closed_until_min_calls():
+    b = breaker()
+    fail(b, 3)
+    assert b.state == "closed" and b.allow()
+
+def test_opens_on_failure_ratio_and_short_circuits():
+    b = breaker()
+    fail(b, 4)
+    assert b.state == "open"
+    assert not b.allow()
+    assert b.stats()["opened"] == 1 and b.stats()["short_circuited"] == 1
+
+def test_successes_keep_it_closed():
+    b = breaker()
+    for ok in (True, False, True, False, True, True):
+        b.record(ok, 0.01)
+    assert b.state == "closed"
+
+def test_slow_calls_count_as_failures():
+    b = breaker()
+    for _ in range(4): b.record(True, 2.0)
+    assert b.state == "open" and b.stats()["slow"] == 4
+
+def test_half_open_probe_closes_it():
+    b = breaker()
+    fail(b, 4)
+    time.sleep(0.06)
+    assert b.allow() and b.state == "half_open"
+    assert not b.allow() # one probe at a time
+    b.record(True, 0.01)
+    assert b.state == "closed" and b.allow()
+
+def test_failed_probe_reopens_it():
+    b = breaker()
+    fail(b, 4)
+    time.sleep(0.06)
+    assert b.allow()
+    b.record(False, 0.01)
+    assert b.state == "open" and not b.allow() and b.stats()["opened"] == 2
+
+def test_slow_probe_reopens_it():
+    b = breaker()
+    fail(b, 4)
+    time.sleep(0.06)
+    assert b.allow()
+    b.record(True, 2.0)
+    assert b.state == "open"
+
+def test_released_probe_lets_another_through():
+    b = breaker()
+    fail(b, 4)
+    time.sleep(0.06)
+    assert b.allow() and not b.allow()
+    b.release()
+    assert b.allow() and b.state == "half_open"
+
+def test_latency_quantile_needs_samples():
+    b = breaker()
+    for i in range(19): b.record(True, i / 100)
+    assert b.quantile(0.95) is None
+    b.record(True, 0.19)
+    assert b.quantile(0.5) == 0.09
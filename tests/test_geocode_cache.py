@@ -0,0 +1,20 @@
+import time
+from app2 import GeocodeCache
+
+def test_expired_rows_are_purged_at_startup(tmp_path):
+    path = str(tmp_path / "geocode.sqlite3")
+    cache = GeocodeCache(path, 60, 16, 100)
+    cache.put("fresh", 1.0, 2.0)
+    with cache.lock, cache.conn() as db:
+        db.execute("INSERT INTO geocode (key, lat, lon, fetched_at) VALUES ('stale', 3.0, 4.0, ?)", (time.time() - 120,))
+    reopened = GeocodeCache(path, 60, 16, 100)
+    assert reopened.stats()["rows"] == 1 and reopened.evictions == 1
+    assert reopened.get("fresh") == (1.0, 2.0) and reopened.get("stale") is None
+
+def test_rows_stay_under_max_rows_keeping_the_newest(tmp_path):
+    cache = GeocodeCache(str(tmp_path / "geocode.sqlite3"), 3600, 16, 100)
+    for i in range(300): cache.put(f"place {i}", float(i), 0.0)
+    assert cache.stats()["rows"] <= 100 + 255 # purged every 256th write
+    with cache.lock: cache.evict()
+    assert cache.stats()["rows"] == 100
+    assert cache.stored("place 299") == (299.0, 0.0) and cache.stored("place 0") is None
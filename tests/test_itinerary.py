@@ -0,0 +1,40 @@
+import pytest
+from app2 import POI, plan_itinerary, haversine_km
+
+BASE = (26.9124, 75.7873)
+
+def stops(n):
+    # a loose grid of stops around BASE, a few km apart
+    return [POI(f"Stop {i}", f"Road {i}", BASE[0] + (i % 4) * 0.03, BASE[1] + (i // 4) * 0.03) for i in range(n)]
+
+def visited(itinerary):
+    return [s["name"] for day in itinerary for s in day["stops"]]
+
+@pytest.mark.parametrize("n, days", [(1, 1), (7, 3), (12, 4), (5, 5)])
+def test_every_stop_once_and_balanced(n, days):
+    itinerary = plan_itinerary(stops(n), days, BASE)
+    assert [d["day"] for d in itinerary] == list(range(1, days + 1))
+    assert sorted(visited(itinerary)) == sorted(s.name for s in stops(n))
+    sizes = [len(d["stops"]) for d in itinerary]
+    assert min(sizes) >= 1 and max(sizes) <= -(-n // days)
+
+def test_distances_are_a_round_trip_from_the_base():
+    for day in plan_itinerary(stops(9), 3, BASE):
+        legs = [s["leg_km"] for s in day["stops"]]
+        assert legs[0] == pytest.approx(haversine_km(*BASE, day["stops"][0]["lat"], day["stops"][0]["lon"]), abs=0.01)
+        back = haversine_km(day["stops"][-1]["lat"], day["stops"][-1]["lon"], *BASE)
+        assert day["distance_km"] == pytest.approx(sum(legs) + back, abs=0.05)
+
+def test_more_days_than_stops_leaves_empty_days():
+    itinerary = plan_itinerary(stops(2), 4, BASE)
+    assert [len(d["stops"]) for d in itinerary] == [1, 1, 0, 0]
+    assert itinerary[3]["distance_km"] == 0
+
+def test_stops_without_coordinates_are_left_out():
+    wiki = POI("Some Article", "", url="https://en.wikipedia.org/wiki/Some_Article")
+    assert sorted(visited(plan_itinerary([wiki] + stops(3), 2, BASE))) == ["Stop 0", "Stop 1", "Stop 2"]
+    assert plan_itinerary([wiki], 2, BASE) == []
+    assert plan_itinerary(stops(3), 0, BASE) == []
+
+def test_deterministic():
+    assert plan_itinerary(stops(10), 3, BASE) == plan_itinerary(stops(10), 3, BASE)
@@ -0,0 +1,81 @@
+import json
+import pytest
+
+# The /plan_trip contract, checked against app2 (Flask) and app2_asgi alike
+# with the bench stub as the upstream: status codes, JSON error bodies, headers.
+
+PLAN_KEYS = {"region", "coordinates", "mood", "days", "stays", "attractions", "restaurants",
+             "estimated_cost", "itinerary", "partial", "sections"}
+
+def plan(client, region, days=2, mood="relaxed", headers=None):
+    return client.request("POST", "/plan_trip", json={"region": region, "days": days, "mood": mood}, headers=headers)
+
+def test_plan(client):
+    status, headers, body = plan(client, f"Stubville {type(client).__name__}")
+    payload = json.loads(body)
+    assert status == 200 and headers["content-type"] == "application/json"
+    assert set(payload) == PLAN_KEYS
+    assert not payload["partial"] and set(payload["sections"].values()) == {"ok"}
+    assert len(payload["itinerary"]) == 2
+    assert headers["etag"] and headers["cache-control"].startswith("public, max-age=")
+
+def test_plan_get_and_revalidate(client):
+    region = f"Getville {type(client).__name__}"
+    status, headers, body = client.request("GET", "/plan_trip", params={"region": region, "days": "3", "mood": "cultural"})
+    assert status == 200 and json.loads(body)["days"] == 3
+    status, again, body = client.request("GET", "/plan_trip", params={"region": region, "days": "3", "mood": "cultural"},
+                                         headers={"If-None-Match": headers["etag"]})
+    assert status == 304 and body == b"" and again["etag"] == headers["etag"]
+
+def test_cached_plan_echoes_its_own_request(client):
+    name = type(client).__name__
+    plan(client, f"Echoville {name}")
+    status, _, body = plan(client, f"echoville  {name}", mood="Relaxed ")
+    payload = json.loads(body)
+    assert status == 200 and payload["region"] == f"echoville  {name}" and payload["mood"] == "relaxed "
+
+BAD_REQUESTS = [
+    ({"json": {"region": "Goa", "days": 0}}, "Bad request: days must be between 1 and 30"),
+    ({"json": {"region": "Goa", "days": 31}}, "Bad request: days must be between 1 and 30"),
+    ({"json": {"region": "Goa", "days": "three"}}, None),
+    ({"json": ["Goa", 3]}, "Bad request: expected a JSON object"),
+    ({"content": b"{not json", "headers": {"Content-Type": "application/json"}}, "Bad request: expected a JSON object"),
+    ({"content": b"region=Goa", "headers": {"Content-Type": "text/plain"}}, "Bad request: expected a JSON object"),
+]
+
+@pytest.mark.parametrize("request_kwargs, error", BAD_REQUESTS)
+def test_bad_request_is_the_same_json_400(both, request_kwargs, error):
+    answers = {name: c.request("POST", "/plan_trip", **request_kwargs) for name, c in both.items()}
+    for status, headers, body in answers.values():
+        assert status == 400 and headers["content-type"] == "application/json"
+        assert json.loads(body)["error"].startswith("Bad request: ")
+        if error: assert json.loads(body) == {"error": error}
+    assert json.loads(answers["flask"][2]) == json.loads(answers["asgi"][2])
+
+def test_unknown_region_is_400(client, stub):
+    stub.empty_rate = 1.0
+    status, headers, body = plan(client, f"Nowhereland {type(client).__name__}")
+    assert status == 400 and json.loads(body) == {"error": "Could not geocode region"}
+
+def test_geocoder_down_is_503(client, stub):
+    stub.error_rate = 1.0
+    status, headers, body = plan(client, f"Downtown {type(client).__name__}")
+    payload = json.loads(body)
+    assert status == 503 and payload["partial"] and payload["sections"] == {"coordinates": "error"}
+    assert "etag" not in headers
+
+@pytest.mark.parametrize("app, region", [("flask", "Munnar"), ("asgi", "Ooty")])
+def test_partial_plan_is_not_cacheable(both, stub, app, region):
+    # the region is in the gazetteer, so only the places lookups hit the failing stub
+    stub.error_rate = 1.0
+    status, headers, body = plan(both[app], region)
+    payload = json.loads(body)
+    assert status == 200 and payload["partial"] and "error" in payload["sections"].values()
+    assert headers["cache-control"] == "no-store" and "etag" not in headers
+    stub.error_rate = 0.0
+    status, headers, body = plan(both[app], region)
+    assert status == 200 and not json.loads(body)["partial"] and "etag" in headers
+
+def test_unknown_route(client):
+    status, headers, body = client.request("GET", "/nope")
+    assert status == 404
@@ -0,0 +1,19 @@
+import time
+from app2 import plan_trips
+
+def test_yields_each_trip_and_rejects_bad_ones():
+    results = sorted(plan_trips([("Batchville", 2, "relaxed"), {"region": "Batchville", "days": 0}, ("Batchford", 1, "cultural")]))
+    assert [(i, status) for i, status, _ in results] == [(0, 200), (1, 400), (2, 200)]
+    assert results[1][2]["error"].startswith("Invalid trip: ")
+
+def test_abandoned_batch_stops_planning(stub):
+    # a consumer that goes away (a disconnected stream) must not wait for, or pay for, the rest
+    stub.latency = 0.1
+    trips = plan_trips([(f"Abandonville {i}", 2, "relaxed") for i in range(20)], workers=2)
+    next(trips)
+    started = time.monotonic()
+    trips.close()
+    assert time.monotonic() - started < 0.5
+    sent = stub.counters["requests"]
+    time.sleep(0.5)
+    assert stub.counters["requests"] - sent <= 6 # only lookups already in flight finish
@@ -0,0 +1,54 @@
+import threading, time
+import pytest
+from app2 import RateLimiter, RateLimited
+
+def drained(rate, max_queue=8):
+    # a limiter whose one banked token is already spent
+    limiter = RateLimiter("test", rate, 0, max_queue)
+    assert limiter.acquire("interactive", 1.0) == 0.0
+    return limiter
+
+def test_idle_host_grants_at_once():
+    limiter = RateLimiter("test", 10, 1, 8)
+    assert limiter.acquire("prewarm", 0) == 0.0
+    assert limiter.stats()["granted"] == 1
+
+def test_lowest_priority_value_goes_first():
+    limiter, order = drained(10), []
+    def wait(priority):
+        limiter.acquire(priority, 5.0)
+        order.append(priority)
+    threads = []
+    for priority in ("prewarm", "batch", "interactive"):
+        threads.append(threading.Thread(target=wait, args=(priority,)))
+        threads[-1].start()
+        time.sleep(0.02) # queued in this order, all before the next token at 100 ms
+    for t in threads: t.join()
+    assert order == ["interactive", "batch", "prewarm"]
+
+def test_waits_for_the_next_token():
+    limiter = drained(20)
+    waited = limiter.acquire("batch", 1.0)
+    assert 0.02 < waited < 0.2
+
+def test_rejects_a_wait_over_budget():
+    limiter = drained(1)
+    with pytest.raises(RateLimited, match="wait over budget"):
+        limiter.acquire("interactive", 0.05)
+    assert limiter.stats()["rejected"] == 1
+
+def test_rejects_when_the_queue_is_full():
+    limiter = drained(2, max_queue=1)
+    waiter = threading.Thread(target=limiter.acquire, args=("batch", 5.0))
+    waiter.start()
+    time.sleep(0.05)
+    with pytest.raises(RateLimited, match="queue full"):
+        limiter.acquire("interactive", 5.0)
+    waiter.join()
+    assert limiter.stats()["queue_depth"] == 0
+
+def test_throttled_holds_everyone_back():
+    limiter = RateLimiter("test", 100, 1, 8)
+    limiter.throttled(0.2)
+    with pytest.raises(RateLimited):
+        limiter.acquire("interactive", 0.05)
@@ -0,0 +1,48 @@
+import app2
+from app2 import LRUCache, POI, Snapshot, places_cell, store_places, unpack_rows, write_snapshot
+
+def fetch(lat, lon, categories, names):
+    # a cell fetch put in the places cache as if it came from upstream
+    key, (clat, clon), radius = places_cell(lat, lon, categories, 15000, 30)
+    rows = [POI(name, f"{name} Road", clat + i * 0.001, clon, tuple(categories)) for i, name in enumerate(names)]
+    store_places(key, rows, clat, clon, categories, radius)
+    return key, rows
+
+def test_round_trip(tmp_path, monkeypatch):
+    monkeypatch.setattr(app2, "snapshot", Snapshot(str(tmp_path / "missing.bin")))
+    app2.geocode_cache.put("snapshotpur", 12.5, 77.25)
+    key, rows = fetch(12.5, 77.25, ["tourism.sights"], ["Old Fort", "New Fort"])
+    path = str(tmp_path / "snap.bin")
+    written = write_snapshot(path)
+    assert written["places"] >= 1 and written["bytes"] > 0
+
+    loaded = Snapshot(path)
+    assert loaded.geocode("snapshotpur") == (12.5, 77.25)
+    assert loaded.geocode("nowhere") is None
+    blobs = {k: blob for k, *_, blob in loaded.unloaded()}
+    assert [(p.name, p.address, p.lat, p.lon, p.categories) for p in unpack_rows(blobs[key])] == \
+        [(p.name, p.address, p.lat, p.lon, p.categories) for p in rows]
+
+def test_rewrite_keeps_entries_this_process_never_used(tmp_path, monkeypatch):
+    monkeypatch.setattr(app2, "snapshot", Snapshot(str(tmp_path / "missing.bin")))
+    app2.geocode_cache.put("carrypur", 13.5, 78.25)
+    key, _ = fetch(13.5, 78.25, ["tourism.sights"], ["Carried Temple"])
+    first = str(tmp_path / "first.bin")
+    write_snapshot(first)
+
+    # a fresh process: nothing live, the first snapshot mapped but not promoted
+    monkeypatch.setattr(app2, "snapshot", Snapshot(first))
+    monkeypatch.setattr(app2.geocode_cache, "lru", LRUCache(16, 3600))
+    monkeypatch.setattr(app2, "places_cache", LRUCache(16, 3600))
+    second = str(tmp_path / "second.bin")
+    write_snapshot(second)
+
+    loaded = Snapshot(second)
+    assert loaded.geocode("carrypur") == (13.5, 78.25)
+    assert key in {k for k, *_ in loaded.unloaded()}
+
+def test_not_a_snapshot(tmp_path):
+    path = tmp_path / "junk.bin"
+    path.write_bytes(b"not a snapshot at all")
+    snap = Snapshot(str(path))
+    assert snap.mm is None and snap.geocode("goa") is None and snap.unloaded() == []
@@ -0,0 +1,47 @@
+from app2 import Suggester, gazetteer_key
+
+def place(name, popularity, *aliases):
+    return {"name": name, "kind": "city", "popularity": popularity, "aliases": aliases}
+
+PLACES = [place("Goa", 100), place("North Goa", 90, "north goa district"), place("Gokarna", 70),
+          place("Jaipur", 98, "pink city"), place("Jaisalmer", 80, "sand city")]
+
+def suggester(regions=(), max_regions=10):
+    index = {gazetteer_key(alias): p for p in PLACES for alias in (p["name"],) + p["aliases"]}
+    return Suggester(PLACES, index, list(regions), max_regions)
+
+def names(results):
+    return [r["name"] for r in results]
+
+def test_prefix_by_popularity():
+    assert names(suggester().suggest("go", 10)) == ["Goa", "Gokarna", "North Goa"]
+    assert names(suggester().suggest("jai", 10)) == ["Jaipur", "Jaisalmer"]
+
+def test_first_word_matches_rank_above_inner_words():
+    # "North Goa" is more popular than "Gokarna" but only matches on its second word
+    assert names(suggester().suggest("go", 2)) == ["Goa", "Gokarna"]
+
+def test_aliases_find_their_place_once():
+    assert names(suggester().suggest("pink", 10)) == ["Jaipur"]
+    assert names(suggester().suggest("city", 10)) == ["Jaipur", "Jaisalmer"] # inner words of the aliases
+    assert names(suggester().suggest("north goa", 10)) == ["North Goa"]
+
+def test_query_is_normalized_and_limited():
+    assert names(suggester().suggest("  JAI ", 1)) == ["Jaipur"]
+    assert suggester().suggest("", 10) == [] and suggester().suggest("xyz", 10) == []
+
+def test_geocoded_regions_and_popularity():
+    s = suggester(regions=["kodaikanal"])
+    assert s.suggest("koda", 10) == [{"name": "Kodaikanal", "kind": "geocoded"}]
+    s.add_region("kotagiri")
+    assert names(s.suggest("ko", 10)) == ["Kodaikanal", "Kotagiri"]
+    s.planned("kotagiri")
+    assert names(s.suggest("ko", 10)) == ["Kotagiri", "Kodaikanal"]
+
+def test_regions_are_capped_and_never_shadow_the_gazetteer():
+    s = suggester(regions=["kodaikanal"], max_regions=1)
+    s.add_region("kotagiri")
+    s.add_region("goa")
+    assert names(s.suggest("ko", 10)) == ["Kodaikanal"]
+    assert names(s.suggest("goa", 10)) == ["Goa", "North Goa"]
+    assert s.stats()["geocoded_regions"] == 1